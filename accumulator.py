@@ -0,0 +1,76 @@
+"""An incremental, in memory, accumulator for a growing MMR
+
+The accumulator is the list of peak hashes for the current MMR size. Adding a
+leaf only ever merges the lowest peaks, so maintaining the list directly
+avoids reading any nodes back from the store. The list can be persisted and
+restored so that a writer can resume without scanning its store.
+"""
+from typing import List
+
+from algorithms import hash_pospair64
+from algorithms import index_height
+from algorithms import peaks
+
+
+class Accumulator:
+    """The peak hashes, in descending order of height, for MMR(size - 1)"""
+
+    VALUE_SIZE = 32
+
+    def __init__(self, size: int = 0, accumulator: List[bytes] = None, hasher=None):
+        accumulator = list(accumulator or [])
+        if len(accumulator) != len(peaks(size - 1)):
+            raise ValueError(
+                "MMR(%d) has %d peaks, not %d" % (size - 1, len(peaks(size - 1)), len(accumulator)))
+
+        self.size = size
+        self.peaks = accumulator
+        self.hash_pospair64 = hash_pospair64 if hasher is None else hasher.hash_pospair64
+
+    @classmethod
+    def from_db(cls, db, size: int, hasher=None) -> "Accumulator":
+        """Read the accumulator for MMR(size - 1) from db"""
+        return cls(size, [bytes(db.get(p)) for p in peaks(size - 1)], hasher)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, hasher=None) -> "Accumulator":
+        """Restore an accumulator persisted by to_bytes"""
+        size = int.from_bytes(data[:8], byteorder="big", signed=False)
+        w = cls.VALUE_SIZE
+        if (len(data) - 8) % w:
+            raise ValueError("accumulator data is not a whole number of peaks")
+        return cls(size, [bytes(data[o:o + w]) for o in range(8, len(data), w)], hasher)
+
+    def to_bytes(self) -> bytes:
+        """Returns the mmr size, as 8 big endian bytes, followed by the peaks"""
+        return self.size.to_bytes(8, byteorder="big", signed=False) + b"".join(self.peaks)
+
+    def add_leaf_hash(self, f: bytes, db=None) -> int:
+        """Adds the leaf hash value f, merging peaks as necessary
+
+        Args:
+            f (bytes): the leaf hash value entry to add
+            db: optional, if provided, the leaf and any interior nodes are
+                appended to it, as they would be by algorithms.add_leaf_hash
+        Returns:
+            (int): the mmr index where the the next leaf would placed.
+        """
+        g = 0
+        i = self.size
+        self.peaks.append(f)
+        if db is not None:
+            db.append(f)
+        i += 1
+
+        while index_height(i) > g:
+            right = self.peaks.pop()
+            left = self.peaks.pop()
+            v = self.hash_pospair64(i + 1, left, right)
+            self.peaks.append(v)
+            if db is not None:
+                db.append(v)
+            i += 1
+            g += 1
+
+        self.size = i
+        return i
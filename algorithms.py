@@ -2,7 +2,12 @@ from typing import List, Tuple
 import hashlib
 
 
-def add_leaf_hash(db, f: bytes) -> int:
+# Set by instrumentation while any of its blocks are open, otherwise None. The
+# hook points below cost a single check when it is None.
+hooks = None
+
+
+def add_leaf_hash(db, f: bytes, hasher=None) -> int:
     """Adds the leaf hash value f to the MMR.
 
     Interior nodes are appended by this algorithm as necessary to for a complete mmr.
@@ -13,10 +18,14 @@ def add_leaf_hash(db, f: bytes) -> int:
               value added available to subsequent get calls in the same invocation.
             - get must return the requested value or raise an exception.
         v (bytes): the leaf hash value entry to add
+        hasher: optional, a hash_backend providing hash_pospair64.
     Returns:
         (int): the mmr index where the the next leaf would placed on a subsequent call to addleafhash.
     """
+    if hooks is not None and hooks.wants_span("add_leaf_hash"):
+        return hooks.span("add_leaf_hash", add_leaf_hash, db, f, hasher)
 
+    hash_pair = hash_pospair64 if hasher is None else hasher.hash_pospair64
     g = 0
     i = db.append(f)
 
@@ -24,12 +33,66 @@ def add_leaf_hash(db, f: bytes) -> int:
         left = db.get(i - (2 << g))
         right = db.get(i - 1)
 
-        i = db.append(hash_pospair64(i + 1, left, right))
+        i = db.append(hash_pair(i + 1, left, right))
         g += 1
 
     return i
 
 
+def add_leaf_hashes(db, leaves: List[bytes], hasher=None) -> int:
+    """Adds each of the leaf hash values in leaves to the MMR.
+
+    Produces exactly the same node sequence as calling add_leaf_hash for each
+    leaf in turn. The peaks of the current MMR are read once, and the right
+    spine is then maintained locally, so no interior node is re-read through
+    db.get. All the new nodes are written with a single call to db.extend.
+
+    Args:
+        db: an interface providing the required extend, get and len methods.
+            - len(db) must return the index where the next item will be added.
+              This is assumed to identify a complete mmr.
+            - extend must add all of the values in order and return the index
+              for the next item to be added.
+            - get must return the requested value or raise an exception.
+        leaves (List[bytes]): the leaf hash values to add, in order.
+        hasher: optional, a hash_backend providing hash_pospair64.
+    Returns:
+        (int): the mmr index where the the next leaf would placed on a subsequent call to addleafhash.
+    """
+    if hooks is not None and hooks.wants_span("add_leaf_hashes"):
+        return hooks.span("add_leaf_hashes", add_leaf_hashes, db, leaves, hasher)
+
+    hash_pair = hash_pospair64 if hasher is None else hasher.hash_pospair64
+    i = len(db)
+
+    # The accumulator peaks are the only existing nodes the new leaves can be
+    # merged with, and they are listed highest first, so they form the bottom
+    # of the spine stack.
+    spine = [db.get(p) for p in peaks(i - 1)]
+    nodes = []
+
+    for f in leaves:
+        g = 0
+        nodes.append(f)
+        spine.append(f)
+        i += 1
+
+        while index_height(i) > g:
+            right = spine.pop()
+            left = spine.pop()
+
+            v = hash_pair(i + 1, left, right)
+            nodes.append(v)
+            spine.append(v)
+            i += 1
+            g += 1
+
+    if not nodes:
+        return i
+
+    return db.extend(nodes)
+
+
 def inclusion_proof_path(i, c):
     """Returns the list of node indices proving inclusion of i
 
@@ -92,7 +155,7 @@ def inclusion_proof_path(i, c):
 
 
 def included_root(
-    i: int, nodehash: bytes, proof: List[bytes]
+    i: int, nodehash: bytes, proof: List[bytes], hasher=None
 ) -> Tuple[bool, int]:
     """Apply the proof to nodehash to produce the implied root
 
@@ -104,11 +167,14 @@ def included_root(
         i (int): the mmr index where `nodehash` is located.
         nodehash (bytes): the value whose inclusion is being proven.
         proof (List[bytes]): the siblings required to produce `root` from `nodehash`.
+        hasher: optional, a hash_backend providing hash_pospair64.
 
     Returns:
         the root hash produced for `nodehash` using `path`
     """
 
+    hash_pair = hash_pospair64 if hasher is None else hasher.hash_pospair64
+
     # set `root` to the value whose inclusion is to be proven
     root = nodehash
 
@@ -123,12 +189,12 @@ def included_root(
             # advance i to the parent. As i is a right child, the parent is at `i+1`
             i = i + 1
             # Set `root` to `H(i+1 || sibling || root)`
-            root = hash_pospair64(i + 1, sibling, root)
+            root = hash_pair(i + 1, sibling, root)
         else:
             # Advance i to the parent. As i is a left child, the parent is at `i + (2^(g+1))`
             i = i + (2 << g)
             # Set `root` to `H(i+1 || root || sibling)`
-            root = hash_pospair64(i + 1, root, sibling)
+            root = hash_pair(i + 1, root, sibling)
 
         # Set g to the height index above the current
         g = g + 1
@@ -158,6 +224,7 @@ def consistent_roots(
     ifrom: int,
     accumulatorfrom: List[bytes],
     proofs: List[List[bytes]],
+    hasher=None,
 ) -> List[bytes]:
     """Apply the inclusion paths for each origin accumulator peak
 
@@ -179,7 +246,7 @@ def consistent_roots(
 
     roots = []
     for i in range(len(accumulatorfrom)):
-        root = included_root(frompeaks[i], accumulatorfrom[i], proofs[i])
+        root = included_root(frompeaks[i], accumulatorfrom[i], proofs[i], hasher)
         if roots and roots[-1] == root:
             continue
         roots.append(root)
@@ -192,7 +259,54 @@ def consistent_roots(
 # ------------------------------------------------------------------------------
 
 def index_height(i: int) -> int:
-    """Returns the 0 based height of the mmr entry indexed by i"""
+    """Returns the 0 based height of the mmr entry indexed by i
+
+    Adding the leaf numbered n-1 appends the nodes of heights 0 to
+    trailing_zeros(n), and leaves the mmr with 2n - popcount(n) nodes. So the
+    height of i is found from the smallest leaf count n whose mmr contains i,
+    by counting back from the last node added. As 0 <= popcount(n) <=
+    bit_length(i + 1), n is found by a binary search of about
+    log2(bit_length(i)) steps. Heights for small indices come from a table.
+    """
+    if i < len(_INDEX_HEIGHTS):
+        return _INDEX_HEIGHTS[i]
+
+    s = i + 1
+
+    # find the smallest leaf count n where 2n - popcount(n) >= s
+    lo = (s + 1) >> 1
+    hi = (s + s.bit_length() + 1) >> 1
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if (mid << 1) - mid.bit_count() >= s:
+            hi = mid
+        else:
+            lo = mid + 1
+
+    # the last node added for leaf count lo has height trailing_zeros(lo) and
+    # index 2lo - popcount(lo) - 1. i is found by stepping back down from it.
+    return (lo & -lo).bit_length() - 1 - ((lo << 1) - lo.bit_count() - s)
+
+
+def _index_heights_table(size: int) -> bytes:
+    """Returns the heights of the first size mmr indices"""
+    heights = bytearray()
+    n = 1
+    while len(heights) < size:
+        heights.extend(range((n & -n).bit_length()))
+        n += 1
+    return bytes(heights[:size])
+
+
+_INDEX_HEIGHTS = _index_heights_table(1 << 16)
+
+
+def index_height_jump_left(i: int) -> int:
+    """Returns the 0 based height of the mmr entry indexed by i
+
+    This is the formulation given in the draft, which jumps left until the
+    position is all ones. It is retained as the reference for index_height.
+    """
     # convert the index to a position to take advantage of the bit patterns afforded
     pos = i + 1
     while not all_ones(pos):
@@ -235,6 +349,8 @@ def hash_pospair64(pos: int, a: bytes, b: bytes) -> bytes:
     Returns:
         The value for the node identified by pos
     """
+    if hooks is not None:
+        hooks.hashed(1, 8 + len(a) + len(b))
     h = hashlib.sha256()
     h.update(pos.to_bytes(8, byteorder="big", signed=False))
     h.update(a)
@@ -268,18 +384,22 @@ def verify_consistent_roots(
         ifrom: int,
         accumulatorfrom: List[bytes],
         accumulatorto: List[bytes],
-        fromproofs: List[List[bytes]]) -> bool:
+        fromproofs: List[List[bytes]],
+        hasher=None) -> bool:
     """Verifies that the proofs from a previous accumulator's peaks are consistent
 
     Intended for use when verifying consistency directly against replicated
     sections of the log.
     """
+    if hooks is not None and hooks.wants_span("verify_consistent_roots"):
+        return hooks.span("verify_consistent_roots", verify_consistent_roots,
+                          ifrom, accumulatorfrom, accumulatorto, fromproofs, hasher)
 
     # If all proven nodes match an accumulator peak for MMR(to) then
     # MMR(from) is consistent with MMR(ia). Because both the peaks and
     # the accumulator peaks are listed in descending order of height
     #this can be accomplished with a linear scan.
-    proven = consistent_roots(ifrom, accumulatorfrom, fromproofs)
+    proven = consistent_roots(ifrom, accumulatorfrom, fromproofs, hasher)
 
     ito = 0
     for root in proven:
@@ -304,15 +424,38 @@ def verify_consistent_roots(
     return True
 
 
+def get_nodes(db, indices: List[int]) -> List[bytes]:
+    """Returns the values for indices, in the same order, reading each from db once
+
+    If db provides get_many it is called once, with the distinct indices in
+    ascending order, so that file backed stores read sequentially. Otherwise
+    db.get is called for each distinct index.
+    """
+    distinct = sorted(set(indices))
+    get_many = getattr(db, "get_many", None)
+    if get_many is None:
+        values = dict((i, db.get(i)) for i in distinct)
+    else:
+        values = dict(zip(distinct, get_many(distinct)))
+    return [values[i] for i in indices]
+
+
 def inclusion_proof(db, i, ix) -> List[bytes]:
     """Return a proof showing the node i is included in mmr(ix)"""
-    return [db.get(i) for i in inclusion_proof_path(i, ix)]
+    if hooks is not None and hooks.wants_span("inclusion_proof"):
+        return hooks.span("inclusion_proof", inclusion_proof, db, i, ix)
+
+    return get_nodes(db, inclusion_proof_path(i, ix))
 
 
 def consistency_proof(db, ifrom: int ,ito: int) -> List[List[bytes]]:
     """Return a proof showing MMR(ito) is consistent with MMR(ifrom)"""
+    if hooks is not None and hooks.wants_span("consistency_proof"):
+        return hooks.span("consistency_proof", consistency_proof, db, ifrom, ito)
 
-    return [[db.get(i) for i in path] for path in consistency_proof_paths(ifrom, ito)]
+    paths = consistency_proof_paths(ifrom, ito)
+    values = iter(get_nodes(db, [i for path in paths for i in path]))
+    return [[next(values) for _ in path] for path in paths]
 
 
 def peak_depths(i: int) -> List[int]:
@@ -372,6 +515,17 @@ def mmr_index(e: int) -> int:
     Returns:
         The mmr index `i` for the element `e`
     """
+    # Each leaf before e adds itself and one parent for every trailing one bit
+    # of its ordinal, which sums to 2e - popcount(e) nodes.
+    return (e << 1) - e.bit_count()
+
+
+def mmr_index_peak_sum(e: int) -> int:
+    """Returns the node index for the leaf `e`
+
+    This sums the sizes of the perfect trees preceding e, and is retained as
+    the reference for mmr_index.
+    """
     sum = 0
     while e > 0:
         h = e.bit_length()
@@ -381,6 +535,19 @@ def mmr_index(e: int) -> int:
     return sum
 
 
+def complete_leaf_count(n: int) -> int:
+    """Returns the leaf count of the largest complete MMR with at most n nodes
+
+    The MMR of e leaves has mmr_index(e) nodes, so for a complete mmr size n
+    this is the inverse of mmr_index.
+    """
+    # 2e - popcount(e) is within bit_length of 2e, so this never underestimates e
+    e = (n + (n + 1).bit_length()) >> 1
+    while mmr_index(e) > n:
+        e -= 1
+    return e
+
+
 
 def parent(i: int) -> int:
     """Return the mmr index for the parent of `i`"""
@@ -0,0 +1,85 @@
+"""Consistency proofs with the siblings shared by the peak paths deduplicated
+
+The inclusion paths of the peaks of MMR(ifrom) in MMR(ito) converge: once the
+path of a lower peak reaches an ancestor of a higher peak, the remaining
+siblings are exactly those of the higher peak's path from that ancestor. Here
+the peaks are walked together, each distinct sibling is recorded once, and
+each peak's path refers to the shared siblings by position. The proof is
+fetched with exactly one db.get per distinct node.
+
+expand_consistency_proof recovers the List[List[bytes]] form accepted by
+algorithms.consistent_roots and algorithms.verify_consistent_roots.
+"""
+from typing import List, Tuple
+
+from algorithms import get_nodes
+from algorithms import index_height
+from algorithms import peaks
+
+
+def consistency_proof_nodes(ifrom: int, ito: int) -> Tuple[List[int], List[List[int]]]:
+    """Returns the distinct sibling indices proving consistency of MMR(ifrom) and MMR(ito)
+
+    Returns:
+        A tuple (nodes, refs), where nodes is the list of distinct sibling
+        indices and refs has a list for each peak of MMR(ifrom). The inclusion
+        path of the peak is [nodes[r] for r in refs[k]] and is identical to
+        algorithms.inclusion_proof_path(peaks(ifrom)[k], ito)
+    """
+    nodes = []
+    slots = {}
+    # the ancestors visited by the walks so far, mapped to the (peak, offset)
+    # from which their remaining path can be taken.
+    visited = {}
+    refs = []
+
+    for ipeak in peaks(ifrom):
+        path = []
+        i = ipeak
+        g = index_height(i)
+
+        while True:
+            if i in visited:
+                (k, offset) = visited[i]
+                path.extend(refs[k][offset:])
+                break
+            visited[i] = (len(refs), len(path))
+
+            siblingoffset = 2 << g
+            if index_height(i + 1) > g:
+                isibling = i - siblingoffset + 1
+                i += 1
+            else:
+                isibling = i + siblingoffset - 1
+                i += siblingoffset
+
+            if isibling > ito:
+                break
+
+            slot = slots.get(isibling)
+            if slot is None:
+                slot = slots[isibling] = len(nodes)
+                nodes.append(isibling)
+            path.append(slot)
+            g += 1
+
+        refs.append(path)
+
+    return nodes, refs
+
+
+def consistency_proof_deduplicated(db, ifrom: int, ito: int) -> Tuple[List[bytes], List[List[int]]]:
+    """Return a deduplicated proof showing MMR(ito) is consistent with MMR(ifrom)
+
+    Each distinct node is read from db exactly once, see algorithms.get_nodes
+
+    Returns:
+        A tuple (values, refs), see consistency_proof_nodes
+    """
+    nodes, refs = consistency_proof_nodes(ifrom, ito)
+    return get_nodes(db, nodes), refs
+
+
+def expand_consistency_proof(values: List[bytes], refs: List[List[int]]) -> List[List[bytes]]:
+    """Returns the proof in the form produced by algorithms.consistency_proof"""
+    return [[values[r] for r in path] for path in refs]
@@ -0,0 +1,87 @@
+"""Consistency verification which avoids hashing wherever it can
+
+Accepts exactly the proofs accepted by algorithms.verify_consistent_roots,
+with two short cuts:
+
+* A peak of MMR(ifrom) with an empty path is also a peak of MMR(ito), so it is
+  compared directly.
+* The path of a lower peak converges with the path of a higher one at their
+  common ancestor. When the walk for the lower peak reaches a node already
+  computed for a higher peak, the values are compared, the remaining siblings
+  are checked to be those already applied, and the walk stops.
+"""
+from typing import List, Tuple
+
+from algorithms import hash_pospair64
+from algorithms import index_height
+from algorithms import peaks
+
+
+def verify_consistent_roots_fast(
+        ifrom: int,
+        accumulatorfrom: List[bytes],
+        accumulatorto: List[bytes],
+        fromproofs: List[List[bytes]]) -> Tuple[bool, List[int]]:
+    """Verifies that the proofs from a previous accumulator's peaks are consistent
+
+    Returns:
+        A tuple (ok, proven) where ok is True if MMR(ifrom) is consistent with
+        the future accumulator, and proven lists the positions in accumulatorto
+        of the peaks committing MMR(ifrom). proven is empty if ok is False.
+    """
+    frompeaks = peaks(ifrom)
+    if len(frompeaks) != len(accumulatorfrom) or len(frompeaks) != len(fromproofs):
+        return (False, [])
+
+    # The nodes computed by the walks so far, mapped to (value, proof, offset
+    # of the next sibling, the peak which computed it)
+    computed = {}
+    roots = []
+
+    for (ipeak, nodehash, proof) in zip(frompeaks, accumulatorfrom, fromproofs):
+
+        i = ipeak
+        g = index_height(i)
+        root = nodehash
+        shared = None
+
+        for (d, sibling) in enumerate(proof):
+            if index_height(i + 1) > g:
+                i = i + 1
+                root = hash_pospair64(i + 1, sibling, root)
+            else:
+                i = i + (2 << g)
+                root = hash_pospair64(i + 1, root, sibling)
+            g = g + 1
+
+            known = computed.get(i)
+            if known is not None:
+                (value, knownproof, offset, k) = known
+                if value != root or proof[d + 1:] != knownproof[offset:]:
+                    return (False, [])
+                shared = k
+                break
+
+            computed[i] = (root, proof, d + 1, len(roots))
+
+        roots.append(roots[shared] if shared is not None else root)
+
+    # Match the roots against the future accumulator, as verify_consistent_roots does
+    proven = []
+    ito = 0
+    for root in roots:
+        if accumulatorto[ito] == root:
+            if not proven:
+                proven.append(ito)
+            continue
+
+        ito += 1
+
+        if ito >= len(accumulatorto):
+            return (False, [])
+
+        if accumulatorto[ito] != root:
+            return (False, [])
+        proven.append(ito)
+
+    return (True, proven)
@@ -0,0 +1,120 @@
+"""Vectorized variants of the index algorithms, for bulk use with numpy
+
+Each function accepts an array like of mmr indices, or leaf ordinals, and
+returns numpy arrays of uint64 values. The results are identical to applying
+the corresponding scalar function from algorithms to each element.
+
+numpy is required by this module, but not by any of the others.
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def bit_length(x: np.ndarray) -> np.ndarray:
+    """Returns the bit length of each element of the uint64 array x"""
+    x = x | (x >> 1)
+    x = x | (x >> 2)
+    x = x | (x >> 4)
+    x = x | (x >> 8)
+    x = x | (x >> 16)
+    x = x | (x >> 32)
+    return np.bitwise_count(x).astype(np.uint64)
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    """Returns the count of set bits for each element of the uint64 array x"""
+    return np.bitwise_count(x).astype(np.uint64)
+
+
+def trailing_zeros(x: np.ndarray) -> np.ndarray:
+    """Returns the count of trailing zeros for each element of the uint64 array x
+
+    Elements which are 0 produce 64
+    """
+    return popcount(x ^ (x - np.uint64(1))) - np.uint64(1)
+
+
+def mmr_indices(leaves) -> np.ndarray:
+    """Returns the mmr indices of the leaf ordinals in leaves
+
+    See algorithms.mmr_index.
+    """
+    e = np.asarray(leaves, dtype=np.uint64)
+    return (e << np.uint64(1)) - popcount(e)
+
+
+def index_heights(indices) -> np.ndarray:
+    """Returns the 0 based heights of the mmr entries indexed by indices
+
+    See algorithms.index_height. The binary search for the leaf count is run
+    for all elements at once, until every element has converged.
+    """
+    s = np.asarray(indices, dtype=np.uint64) + np.uint64(1)
+
+    # find the smallest leaf count n where 2n - popcount(n) >= s
+    lo = (s + np.uint64(1)) >> np.uint64(1)
+    hi = (s + bit_length(s) + np.uint64(1)) >> np.uint64(1)
+    while np.any(lo < hi):
+        mid = (lo + hi) >> np.uint64(1)
+        contained = (mid << np.uint64(1)) - popcount(mid) >= s
+        hi = np.where(contained, mid, hi)
+        lo = np.where(contained, lo, mid + np.uint64(1))
+
+    return trailing_zeros(lo) - ((lo << np.uint64(1)) - popcount(lo) - s)
+
+
+def inclusion_proof_paths(indices, c: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the inclusion proof paths of all indices with respect to c
+
+    See algorithms.inclusion_proof_path. The paths are computed a level at a
+    time for all of the indices whose paths have not yet terminated.
+
+    Args:
+        indices: the mmr indices of the nodes whose inclusion paths are required.
+        c (int): The index of the last node of any complete MMR that contains
+            all of the indices.
+
+    Returns:
+        A ragged array as the tuple (paths, offsets). The path for indices[j]
+        is paths[offsets[j]:offsets[j+1]]
+    """
+    i = np.asarray(indices, dtype=np.uint64)
+    c = np.uint64(c)
+
+    # The columns of the level arrays refer to these positions in indices.
+    # Columns are dropped as their paths terminate.
+    columns = np.arange(len(i))
+    g = index_heights(i)
+
+    levels = []
+    while len(i):
+        siblingoffset = np.uint64(2) << g
+
+        # where the height of i+1 is greater than g, i is a right sibling,
+        # its witness is behind and its parent is immediately after.
+        right = index_heights(i + np.uint64(1)) > g
+        isibling = np.where(
+            right, i - siblingoffset + np.uint64(1), i + siblingoffset - np.uint64(1))
+        i = np.where(right, i + np.uint64(1), i + siblingoffset)
+
+        # paths terminate at the first sibling which is outside of MMR(c)
+        included = isibling <= c
+        levels.append((columns[included], isibling[included]))
+
+        columns = columns[included]
+        i = i[included]
+        g = g[included] + np.uint64(1)
+
+    lengths = np.zeros(len(indices), dtype=np.int64)
+    for (columns, _) in levels:
+        lengths[columns] += 1
+
+    offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    paths = np.empty(offsets[-1], dtype=np.uint64)
+    for (d, (columns, isibling)) in enumerate(levels):
+        paths[offsets[columns] + d] = isibling
+
+    return paths, offsets
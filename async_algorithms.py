@@ -0,0 +1,130 @@
+"""asyncio variants of the algorithms which read from the store
+
+The index algorithms need no store, so the full set of nodes required for a
+proof is known before any are read. Here those nodes are fetched concurrently,
+with at most `concurrency` reads outstanding, from a store whose get and
+append methods are coroutines.
+
+Concurrent calls to async_add_leaf_hash on the same store are serialised by a
+lock held for that store, as each call awaits between its appends and would
+otherwise interleave its nodes with those of another call. This only
+serialises writers within one event loop; writers in other processes must be
+excluded by the store itself.
+
+AsyncFlatDB is an in process store satisfying that interface, for testing.
+"""
+import asyncio
+import weakref
+from typing import Dict, Iterable, List
+
+from algorithms import consistency_proof_paths
+from algorithms import hash_pospair64
+from algorithms import inclusion_proof_path
+from algorithms import index_height
+
+
+_writer_locks = weakref.WeakKeyDictionary()
+
+
+def writer_lock(db) -> asyncio.Lock:
+    """Returns the lock serialising async_add_leaf_hash calls for db"""
+    lock = _writer_locks.get(db)
+    if lock is None:
+        lock = _writer_locks[db] = asyncio.Lock()
+    return lock
+
+
+async def fetch_nodes(db, indices: Iterable[int], concurrency: int = 16) -> Dict[int, bytes]:
+    """Read each of the distinct indices from the async db, concurrently
+
+    Returns:
+        A dict mapping each index to its value
+    """
+    indices = sorted(set(indices))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get(i):
+        async with semaphore:
+            return await db.get(i)
+
+    values = await asyncio.gather(*[get(i) for i in indices])
+    return dict(zip(indices, values))
+
+
+async def async_inclusion_proof(db, i: int, ix: int, concurrency: int = 16) -> List[bytes]:
+    """Return a proof showing the node i is included in mmr(ix)"""
+    path = inclusion_proof_path(i, ix)
+    values = await fetch_nodes(db, path, concurrency)
+    return [values[i] for i in path]
+
+
+async def async_consistency_proof(db, ifrom: int, ito: int, concurrency: int = 16) -> List[List[bytes]]:
+    """Return a proof showing MMR(ito) is consistent with MMR(ifrom)"""
+    paths = consistency_proof_paths(ifrom, ito)
+    values = await fetch_nodes(db, [i for path in paths for i in path], concurrency)
+    return [[values[i] for i in path] for path in paths]
+
+
+async def async_add_leaf_hash(db, f: bytes, concurrency: int = 16) -> int:
+    """Adds the leaf hash value f to the MMR in the async db
+
+    See algorithms.add_leaf_hash. The left children of every interior node to
+    be added are existing peaks, so they are all read, concurrently, before
+    the interior nodes are computed. The right child of each is always the
+    node added immediately before, and is not read back.
+
+    Concurrent calls for the same db are serialised, see writer_lock.
+
+    Returns:
+        (int): the mmr index where the the next leaf would placed
+    """
+    async with writer_lock(db):
+        return await _add_leaf_hash(db, f, concurrency)
+
+
+async def _add_leaf_hash(db, f: bytes, concurrency: int) -> int:
+    i = await db.append(f)
+
+    lefts = []
+    g = 0
+    while index_height(i + g) > g:
+        lefts.append(i + g - (2 << g))
+        g += 1
+
+    values = await fetch_nodes(db, lefts, concurrency)
+
+    right = f
+    for ileft in lefts:
+        right = hash_pospair64(i + 1, values[ileft], right)
+        i = await db.append(right)
+
+    return i
+
+
+class AsyncFlatDB:
+    """An in process async store, wrapping a list, for testing
+
+    Each get sleeps for latency seconds, and the greatest number of concurrent
+    gets is recorded in max_concurrent.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.store = []
+        self.latency = latency
+        self.reads = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+    async def append(self, v):
+        self.store.append(v)
+        return len(self.store)  # index of the *NEXT* item that will be added
+
+    async def get(self, i):
+        self.reads += 1
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            await asyncio.sleep(self.latency)
+            return self.store[i]
+        finally:
+            self.concurrent -= 1
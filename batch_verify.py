@@ -0,0 +1,91 @@
+"""Batch verification of many inclusion proofs
+
+Receipts produced against the same accumulator share the upper portions of
+their proofs, and receipts for neighbouring nodes share the lower portions too.
+Verifying them together allows each distinct interior node to be hashed once.
+
+For very large batches, the work can be spread across a
+concurrent.futures.ProcessPoolExecutor.
+"""
+from typing import Dict, List, Tuple
+
+from algorithms import index_height, hash_pospair64
+
+
+def included_root_memo(
+    i: int, nodehash: bytes, proof: List[bytes], memo: Dict[Tuple[int, bytes, bytes], bytes]
+) -> bytes:
+    """Apply the proof to nodehash to produce the implied root
+
+    Identical to algorithms.included_root, except that each interior node hash
+    is looked up in memo, keyed by (parent index, left, right), before it is
+    computed. memo is updated with any node hashes which are computed.
+
+    The keys hold the node values as bytes, as the values may be unhashable
+    buffers, such as the writable memoryviews returned by db.MmapDB.
+    """
+    root = bytes(nodehash)
+    g = index_height(i)
+
+    for sibling in proof:
+        if index_height(i + 1) > g:
+            i = i + 1
+            key = (i, bytes(sibling), root)
+        else:
+            i = i + (2 << g)
+            key = (i, root, bytes(sibling))
+
+        root = memo.get(key)
+        if root is None:
+            root = memo[key] = hash_pospair64(i + 1, key[1], key[2])
+
+        g = g + 1
+
+    return root
+
+
+def verify_inclusions(items: List[Tuple[int, bytes, List[bytes], bytes]]) -> List[bool]:
+    """Verify each (i, nodehash, proof, root) item, sharing interior node hashes
+
+    Returns:
+        A list with True for each item whose proof produces its root
+    """
+    memo = {}
+    return [included_root_memo(i, nodehash, proof, memo) == root
+            for (i, nodehash, proof, root) in items]
+
+
+def verify_inclusions_batch(
+    items: List[Tuple[int, bytes, List[bytes], bytes]],
+    executor=None,
+    chunksize: int = 4096,
+) -> List[bool]:
+    """Verify many (i, nodehash, proof, root) items, sharing interior node hashes
+
+    Args:
+        items: the mmr index, node hash, inclusion proof and the expected
+            accumulator peak for each node.
+        executor: an optional concurrent.futures.Executor. If provided, and
+            there is more than one chunk of items, the chunks are verified
+            concurrently. Typically this is a ProcessPoolExecutor, as hashlib
+            only releases the GIL for large inputs. The items must be picklable.
+        chunksize (int): the number of items verified by each task. The items
+            are ordered by mmr index before they are chunked, so that
+            neighbouring nodes share interior node hashes.
+
+    Returns:
+        A list with True for each item whose proof produces its root
+    """
+    if executor is None or len(items) <= chunksize:
+        return verify_inclusions(items)
+
+    order = sorted(range(len(items)), key=lambda j: items[j][0])
+    chunks = [order[k:k + chunksize] for k in range(0, len(order), chunksize)]
+
+    results = [False] * len(items)
+    verified = executor.map(verify_inclusions, [[items[j] for j in chunk] for chunk in chunks])
+    for (chunk, oks) in zip(chunks, verified):
+        for (j, ok) in zip(chunk, oks):
+            results[j] = ok
+
+    return results
@@ -0,0 +1,555 @@
+"""Throughput measurements for the algorithms
+
+Run all benchmarks with
+
+    python benchmarks.py
+
+or a single one by naming it, eg
+
+    python benchmarks.py inclusion_proof_paths
+
+Each benchmark returns a dict of its measurements. With --json FILE, these are
+also written to FILE, along with the python version and platform, so that
+results can be compared between versions.
+
+The scaling benchmark measures the core algorithms for MMR sizes from 2^10 to
+2^32, reporting ops/sec, per op latency percentiles and peak memory.
+"""
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from algorithms import hash_pospair64
+from algorithms import inclusion_proof_path
+from hash_backend import hash_backend
+
+
+def _rate(n: int, seconds: float) -> str:
+    return "{:>12,.0f}/s".format(n / seconds)
+
+
+def bench_inclusion_proof_paths(mmrsize=(1 << 21) - 1, count=200000):
+    """Compare the scalar and vectorized inclusion path generation for one MMR"""
+    import numpy as np
+    from algorithms_vectorized import inclusion_proof_paths
+
+    c = mmrsize - 1
+    indices = np.linspace(0, c, count, dtype=np.uint64)
+
+    start = time.perf_counter()
+    scalar = [inclusion_proof_path(i, c) for i in indices.tolist()]
+    tscalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    paths, offsets = inclusion_proof_paths(indices, c)
+    tvector = time.perf_counter() - start
+
+    assert paths.tolist() == [i for path in scalar for i in path]
+
+    print("inclusion_proof_paths: %d paths in MMR(%d)" % (count, c))
+    print("  scalar     %s %8.3fs" % (_rate(count, tscalar), tscalar))
+    print("  vectorized %s %8.3fs" % (_rate(count, tvector), tvector))
+    return {"count": count, "mmrsize": mmrsize, "scalar_seconds": tscalar, "vectorized_seconds": tvector}
+
+
+def bench_hash_pospair64(count=10000000, name="sha256"):
+    """Compare the reference hash_pospair64 with a hash backend"""
+    hasher = hash_backend(name)
+
+    positions = list(range(1, count + 1))
+    lefts = [hashlib.sha256(b"left").digest()] * count
+    rights = [hashlib.sha256(b"right").digest()] * count
+
+    start = time.perf_counter()
+    reference = [hash_pospair64(pos, a, b) for (pos, a, b) in zip(positions, lefts, rights)]
+    treference = time.perf_counter() - start
+
+    hash_pair = hasher.hash_pospair64
+    start = time.perf_counter()
+    single = [hash_pair(pos, a, b) for (pos, a, b) in zip(positions, lefts, rights)]
+    tsingle = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = hasher.hash_pospairs64(positions, lefts, rights)
+    tbatch = time.perf_counter() - start
+
+    assert reference == single == batch
+
+    print("hash_pospair64: %d pairs, %s backend" % (count, name))
+    print("  reference  %s %8.3fs" % (_rate(count, treference), treference))
+    print("  single     %s %8.3fs" % (_rate(count, tsingle), tsingle))
+    print("  batch      %s %8.3fs" % (_rate(count, tbatch), tbatch))
+    return {"count": count, "backend": name, "reference_seconds": treference,
+            "single_seconds": tsingle, "batch_seconds": tbatch}
+
+
+def bench_parallel_build(count=1 << 18, max_workers=None):
+    """Compare serial add_leaf_hashes with the parallel builder, for 1 up to max_workers workers
+
+    The speedup over one worker is only meaningful on a host with at least
+    max_workers cores, which defaults to os.cpu_count().
+    """
+    import concurrent.futures
+    import tempfile
+
+    import parallel_build
+    from algorithms import add_leaf_hashes
+    from db import FlatDB
+
+    leaves = [hashlib.sha256(e.to_bytes(8, "big")).digest() for e in range(count)]
+
+    start = time.perf_counter()
+    add_leaf_hashes(FlatDB(), leaves)
+    tserial = time.perf_counter() - start
+
+    max_workers = max_workers or os.cpu_count()
+    workers = [1 << k for k in range(max_workers.bit_length()) if 1 << k < max_workers] + [max_workers]
+    tparallel = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        leafname = os.path.join(tmpdir, "leaves.bin")
+        with open(leafname, "wb") as f:
+            f.write(b"".join(leaves))
+        for n in workers:
+            with concurrent.futures.ProcessPoolExecutor(n) as executor:
+                start = time.perf_counter()
+                parallel_build.build_file(
+                    os.path.join(tmpdir, "mmr.bin"), leafname, executor=executor, window=2 * n)
+                tparallel[n] = time.perf_counter() - start
+
+    print("parallel_build: %d leaves, %d cores" % (count, os.cpu_count()))
+    print("  serial       %s %8.3fs" % (_rate(count, tserial), tserial))
+    for n in workers:
+        print("  %3d workers  %s %8.3fs  x%.2f" % (
+            n, _rate(count, tparallel[n]), tparallel[n], tparallel[workers[0]] / tparallel[n]))
+    return {"count": count, "cores": os.cpu_count(), "serial_seconds": tserial,
+            "parallel_seconds": tparallel}
+
+
+def bench_sqlite_store(count=1 << 14, batchsize=1024, proofs=20000):
+    """Compare append and proof throughput for FlatDB and SqliteDB"""
+    import tempfile
+
+    from algorithms import add_leaf_hash
+    from algorithms import add_leaf_hashes
+    from algorithms import inclusion_proof
+    from algorithms import mmr_index
+    from db import FlatDB
+    from db import SqliteDB
+
+    leaves = [hashlib.sha256(e.to_bytes(8, "big")).digest() for e in range(count)]
+    rng = random.Random(0)
+
+    flat = FlatDB()
+    start = time.perf_counter()
+    for f in leaves:
+        add_leaf_hash(flat, f)
+    tflat = time.perf_counter() - start
+
+    mmrsize = len(flat)
+    calls = [mmr_index(rng.randrange(count)) for _ in range(proofs)]
+
+    start = time.perf_counter()
+    for i in calls:
+        inclusion_proof(flat, i, mmrsize - 1)
+    tflatproofs = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with SqliteDB(os.path.join(tmpdir, "leaf.sqlite")) as db:
+            start = time.perf_counter()
+            for f in leaves:
+                with db.transaction():
+                    add_leaf_hash(db, f)
+            tleaf = time.perf_counter() - start
+
+        with SqliteDB(os.path.join(tmpdir, "batch.sqlite")) as db:
+            start = time.perf_counter()
+            for b in range(0, count, batchsize):
+                with db.transaction():
+                    add_leaf_hashes(db, leaves[b:b + batchsize])
+            tbatch = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for i in calls:
+                inclusion_proof(db, i, mmrsize - 1)
+            tsqliteproofs = time.perf_counter() - start
+
+    print("sqlite_store: %d leaves, %d proofs" % (count, proofs))
+    print("  flat append          %s %8.3fs" % (_rate(count, tflat), tflat))
+    print("  sqlite append (leaf) %s %8.3fs" % (_rate(count, tleaf), tleaf))
+    print("  sqlite append (%4d) %s %8.3fs" % (batchsize, _rate(count, tbatch), tbatch))
+    print("  flat proofs          %s %8.3fs" % (_rate(proofs, tflatproofs), tflatproofs))
+    print("  sqlite proofs        %s %8.3fs" % (_rate(proofs, tsqliteproofs), tsqliteproofs))
+    return {"count": count, "batchsize": batchsize, "proofs": proofs,
+            "flat_append_seconds": tflat, "sqlite_leaf_append_seconds": tleaf,
+            "sqlite_batch_append_seconds": tbatch, "flat_proof_seconds": tflatproofs,
+            "sqlite_proof_seconds": tsqliteproofs}
+
+
+def bench_group_commit(count=1 << 12, group_commits=(1, 16, 256)):
+    """Compare the append rate of JournaledDB for several group commit sizes"""
+    import tempfile
+
+    from algorithms import add_leaf_hash
+    from journal import JournaledDB
+
+    leaves = [hashlib.sha256(e.to_bytes(8, "big")).digest() for e in range(count)]
+
+    print("group_commit: %d leaves" % count)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for group_commit in group_commits:
+            filename = os.path.join(tmpdir, "mmr%d.bin" % group_commit)
+            start = time.perf_counter()
+            with JournaledDB(filename, group_commit=group_commit) as db:
+                for f in leaves:
+                    add_leaf_hash(db, f)
+            seconds = time.perf_counter() - start
+            print("  %5d leaves %s %8.3fs" % (group_commit, _rate(count, seconds), seconds))
+            results[str(group_commit)] = seconds
+
+    return {"count": count, "seconds": results}
+
+
+def bench_range_proofs(c=(1 << 40) - 2, ranges=(16, 256, 4096), count=20):
+    """Compare range multi-proofs with one inclusion proof per leaf"""
+    from algorithms import included_root
+    from range_proofs import multi_included_roots
+    from range_proofs import multi_proof_path
+    from range_proofs import range_indices
+
+    rng = random.Random(0)
+    value = hashlib.sha256(b"node").digest()
+    leaves = (c + 2) // 2
+
+    print("range_proofs: MMR(%d), %d ranges of each length" % (c, count))
+    results = {}
+    for n in ranges:
+        starts = [rng.randrange(leaves - n) for _ in range(count)]
+        single = multi = 0
+        tsingle = tmulti = 0.0
+        for efrom in starts:
+            indices = range_indices(efrom, efrom + n)
+
+            paths = [inclusion_proof_path(i, c) for i in indices]
+            start = time.perf_counter()
+            for (i, path) in zip(indices, paths):
+                included_root(i, value, [value] * len(path))
+            tsingle += time.perf_counter() - start
+            single += sum(len(path) for path in paths)
+
+            frontier = multi_proof_path(indices, c)
+            start = time.perf_counter()
+            multi_included_roots(indices, [value] * n, [value] * len(frontier), c)
+            tmulti += time.perf_counter() - start
+            multi += len(frontier)
+
+        print("  %5d leaves: single %8d nodes %8.3fs, multi %6d nodes %8.3fs" % (
+            n, single, tsingle, multi, tmulti))
+        results[str(n)] = {"single_nodes": single, "single_seconds": tsingle,
+                           "multi_nodes": multi, "multi_seconds": tmulti}
+
+    return {"c": c, "count": count, "ranges": results}
+
+
+def bench_consistency_proof_reads(ito=(1 << 32) - 2, count=1000):
+    """Compare the store reads for plain and deduplicated consistency proofs"""
+    from algorithms import complete_mmr
+    from algorithms import consistency_proof_paths
+    from algorithms_consistency_deduplicated import consistency_proof_nodes
+
+    rng = random.Random(0)
+    froms = [complete_mmr(rng.randrange(ito)) for _ in range(count)]
+
+    start = time.perf_counter()
+    plain = sum(sum(len(path) for path in consistency_proof_paths(ifrom, ito)) for ifrom in froms)
+    tplain = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dedup = sum(len(consistency_proof_nodes(ifrom, ito)[0]) for ifrom in froms)
+    tdedup = time.perf_counter() - start
+
+    print("consistency_proof_reads: %d proofs into MMR(%d)" % (count, ito))
+    print("  plain        %10d reads %8.3fs" % (plain, tplain))
+    print("  deduplicated %10d reads %8.3fs" % (dedup, tdedup))
+    return {"count": count, "ito": ito, "plain_reads": plain, "deduplicated_reads": dedup,
+            "plain_seconds": tplain, "deduplicated_seconds": tdedup}
+
+
+def _cbor_head(major: int, n: int) -> bytes:
+    if n < 24:
+        return bytes([major << 5 | n])
+    for (ai, w) in ((24, 1), (25, 2), (26, 4), (27, 8)):
+        if n < (1 << (8 * w)):
+            return bytes([major << 5 | ai]) + n.to_bytes(w, "big")
+
+
+def _cbor_encode(v) -> bytes:
+    """A naive CBOR encoder for nested lists of byte strings"""
+    if isinstance(v, list):
+        return _cbor_head(4, len(v)) + b"".join(_cbor_encode(x) for x in v)
+    return _cbor_head(2, len(v)) + bytes(v)
+
+
+def _cbor_decode(data: bytes, offset: int = 0):
+    """A naive CBOR decoder for nested lists of byte strings"""
+    major, ai = data[offset] >> 5, data[offset] & 0x1f
+    offset += 1
+    if ai < 24:
+        n = ai
+    else:
+        w = 1 << (ai - 24)
+        n = int.from_bytes(data[offset:offset + w], "big")
+        offset += w
+    if major == 2:
+        return data[offset:offset + n], offset + n
+    items = []
+    for _ in range(n):
+        item, offset = _cbor_decode(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def bench_proof_encoding(mmrsize=(1 << 21) - 1, count=20000):
+    """Compare the compact proof encoding with naive CBOR lists"""
+    import proof_encoding
+    from algorithms import complete_mmr
+    from algorithms import consistency_proof_paths
+
+    rng = random.Random(0)
+    ito = mmrsize - 1
+    node = hashlib.sha256(b"node").digest()
+    proofs = [[node] * len(inclusion_proof_path(rng.randrange(ito), ito)) for _ in range(count)]
+    consistency = [
+        [[node] * len(path) for path in consistency_proof_paths(complete_mmr(rng.randrange(ito)), ito)]
+        for _ in range(count)]
+
+    results = {"count": count, "mmrsize": mmrsize}
+    for (name, items, encode, decode) in (
+            ("inclusion", proofs,
+             proof_encoding.encode_inclusion_proof, proof_encoding.decode_inclusion_proof),
+            ("consistency", consistency,
+             proof_encoding.encode_consistency_proof, proof_encoding.decode_consistency_proof)):
+
+        start = time.perf_counter()
+        compact = [encode(p) for p in items]
+        tencode = time.perf_counter() - start
+        start = time.perf_counter()
+        for data in compact:
+            decode(data)
+        tdecode = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cbor = [_cbor_encode(p) for p in items]
+        tcborencode = time.perf_counter() - start
+        start = time.perf_counter()
+        for data in cbor:
+            _cbor_decode(data)
+        tcbordecode = time.perf_counter() - start
+
+        print("proof_encoding: %d %s proofs in MMR(%d)" % (count, name, ito))
+        print("  compact bytes %10d encode %s decode %s" % (
+            sum(map(len, compact)), _rate(count, tencode), _rate(count, tdecode)))
+        print("  cbor    bytes %10d encode %s decode %s" % (
+            sum(map(len, cbor)), _rate(count, tcborencode), _rate(count, tcbordecode)))
+        results[name] = {
+            "compact_bytes": sum(map(len, compact)), "compact_encode_seconds": tencode,
+            "compact_decode_seconds": tdecode, "cbor_bytes": sum(map(len, cbor)),
+            "cbor_encode_seconds": tcborencode, "cbor_decode_seconds": tcbordecode}
+
+    return results
+
+
+def _measure(fn, calls, memory_calls: int = 200) -> dict:
+    """Time each fn(*args) for args in calls, then measure the peak memory of a sample"""
+    latencies = []
+    counter = time.perf_counter_ns
+    for args in calls:
+        start = counter()
+        fn(*args)
+        latencies.append(counter() - start)
+    latencies.sort()
+
+    tracemalloc.start()
+    for args in calls[:memory_calls]:
+        fn(*args)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, (len(latencies) * p) // 100)]
+
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) * 1e9 / sum(latencies),
+        "p50_ns": percentile(50),
+        "p90_ns": percentile(90),
+        "p99_ns": percentile(99),
+        "max_ns": latencies[-1],
+        "peak_memory_bytes": peak,
+    }
+
+
+class _SparseDB:
+    """Presents an MMR of size nodes, holding only the peaks and later nodes
+
+    The peak values are random, which is sufficient for timing add_leaf_hash
+    at sizes too large to build.
+    """
+
+    def __init__(self, size: int, rng):
+        from algorithms import peaks
+        self.size = size
+        self.store = dict((p, rng.randbytes(32)) for p in peaks(size - 1))
+
+    def append(self, v):
+        self.store[self.size] = v
+        self.size += 1
+        return self.size
+
+    def get(self, i):
+        return self.store[i]
+
+
+def _consistent_values(ifrom: int, rng):
+    """Returns a function giving node values for a valid extension of MMR(ifrom)
+
+    Only the nodes needed for consistency proofs from MMR(ifrom) are ever
+    evaluated. The peaks of MMR(ifrom), and nodes committing only later
+    leaves, have random values. The nodes committing both are computed from
+    their children. This allows valid proofs for MMRs too large to build.
+    """
+    from algorithms import index_height
+
+    values = {}
+
+    def value(n: int) -> bytes:
+        v = values.get(n)
+        if v is not None:
+            return v
+
+        h = index_height(n)
+        first = n - (2 << h) + 2
+        if first <= ifrom < n:
+            v = hash_pospair64(n + 1, value(n - (1 << h)), value(n - 1))
+        else:
+            v = rng.randbytes(32)
+        values[n] = v
+        return v
+
+    return value
+
+
+def bench_scaling(log2sizes=range(10, 33, 2), count=1000, seed=0):
+    """Measure the core algorithms for a range of MMR sizes"""
+    from algorithms import add_leaf_hash
+    from algorithms import complete_mmr
+    from algorithms import consistency_proof_paths
+    from algorithms import consistent_roots
+    from algorithms import included_root
+    from algorithms import index_height
+    from algorithms import mmr_index
+    from algorithms import peaks
+    from algorithms_consistency_as_flat_array import consistency_proof_flat
+    from algorithms_consistency_as_flat_array import verify_consistency_flat
+
+    rng = random.Random(seed)
+
+    def node():
+        return rng.randbytes(32)
+
+    results = {}
+    for log2size in log2sizes:
+        # the perfect tree of 2^log2size - 1 nodes
+        c = (1 << log2size) - 2
+        leaves = 1 << (log2size - 1)
+        ito = complete_mmr(rng.randrange(c // 2, c))
+
+        indices = [rng.randrange(c + 1) for _ in range(count)]
+        froms = [complete_mmr(rng.randrange(ito)) for _ in range(count)]
+
+        included = []
+        for i in indices:
+            included.append((i, node(), [node() for _ in inclusion_proof_path(i, c)]))
+
+        consistent = []
+        flat = []
+        for ifrom in froms:
+            value = _consistent_values(ifrom, rng)
+            accumulatorfrom = [value(p) for p in peaks(ifrom)]
+            accumulatorto = [value(p) for p in peaks(ito)]
+            proofs = [[value(i) for i in path] for path in consistency_proof_paths(ifrom, ito)]
+            consistent.append((ifrom, accumulatorfrom, proofs))
+            path = [value(i) for i in consistency_proof_flat(ifrom, ito)]
+            flat.append((ifrom, ito, accumulatorfrom, accumulatorto, path))
+            assert verify_consistency_flat(*flat[-1])
+
+        db = _SparseDB(c + 1, rng)
+
+        measurements = [
+            ("add_leaf_hash", add_leaf_hash, [(db, node()) for _ in range(count)]),
+            ("inclusion_proof_path", inclusion_proof_path, [(i, c) for i in indices]),
+            ("included_root", included_root, included),
+            ("consistency_proof_paths", consistency_proof_paths, [(ifrom, ito) for ifrom in froms]),
+            ("consistent_roots", consistent_roots, consistent),
+            ("verify_consistency_flat", verify_consistency_flat, flat),
+            ("peaks", peaks, [(ifrom,) for ifrom in froms]),
+            ("index_height", index_height, [(i,) for i in indices]),
+            ("mmr_index", mmr_index, [(rng.randrange(leaves),) for _ in range(count)]),
+        ]
+
+        results[log2size] = {}
+        for (name, fn, calls) in measurements:
+            m = results[log2size][name] = _measure(fn, calls)
+            print("scaling: 2^%-2d %-24s %s p50 %8.1fus p99 %8.1fus mem %8d" % (
+                log2size, name, _rate(m["ops"], m["ops"] / m["ops_per_sec"]),
+                m["p50_ns"] / 1000, m["p99_ns"] / 1000, m["peak_memory_bytes"]))
+
+    return {"count": count, "seed": seed, "sizes": results}
+
+
+def main(argv):
+    names = []
+    jsonfile = None
+    args = iter(argv)
+    for arg in args:
+        if arg == "--json":
+            jsonfile = next(args, None)
+            if jsonfile is None:
+                print("--json requires a filename")
+                return 1
+            continue
+        names.append(arg)
+
+    if not names:
+        names = [name[len("bench_"):] for name in globals() if name.startswith("bench_")]
+
+    results = {}
+    for name in names:
+        bench = globals().get("bench_%s" % name)
+        if bench is None:
+            print("%s not found" % name)
+            return 1
+        results[name] = bench()
+
+    if jsonfile is not None:
+        report = {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "results": results,
+        }
+        with open(jsonfile, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -76,6 +76,11 @@ ASCII art & notes for the test db and related properties.
     0   1 2   3  4   5  6   7  8   9 10  11 12  13   14   15  16  17   18  19   20
 """
 import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+from contextlib import contextmanager
 
 from algorithms import add_leaf_hash
 from algorithms import leaf_count
@@ -84,6 +89,10 @@ from algorithms import hash_pospair64
 from algorithms import trailing_zeros
 
 
+# The MmapDB sidecar: node count, inode of the data file
+SIDECAR = struct.Struct(">QQ")
+
+
 def hash_num64(v: int) -> bytes:
     """
     Compute the SHA-256 hash of v
@@ -106,9 +115,20 @@ class FlatDB:
         self.store.append(v)
         return len(self.store)  # index of the *NEXT* item that will be added
 
+    def extend(self, values):
+        self.store.extend(values)
+        return len(self.store)  # index of the *NEXT* item that will be added
+
+    def __len__(self):
+        return len(self.store)
+
     def get(self, i):
         return self.store[i]
 
+    def get_many(self, indices):
+        store = self.store
+        return [store[i] for i in indices]
+
     def init_canonical39(self):
         """Re-creates the kat db using addleafhash"""
 
@@ -140,19 +160,271 @@ class FlatDB:
             add_leaf_hash(self, hash_num64(i))
 
 
+class MmapDB:
+    """A file backed store of fixed width nodes, accessed via mmap
+
+    Satisfies the same interface as FlatDB. Nodes are stored contiguously, with
+    a stride of VALUE_SIZE bytes, so the node for mmr index i is at file offset
+    i * VALUE_SIZE. get returns memoryview slices of the mapping rather than
+    copies.
+
+    The file capacity is doubled as necessary, starting from MIN_NODES, so the
+    file is generally longer than the nodes it holds. The node count is
+    recorded in a sidecar file, filename + ".size", which is replaced
+    atomically on open, on flush and on close. A store re-opened after an
+    unclean shutdown resumes from the node count of the last flush, rather
+    than treating the zero padding as nodes. close also truncates the file to
+    the exact node count. A file without a sidecar, eg one written by
+    parallel_build, is taken to hold exactly its length in nodes.
+
+    The sidecar also records the inode of the file it was written for. A
+    sidecar left over from a file which has since been replaced is stale, and
+    is refused rather than trusted. The modification times can not be used
+    for this, as after an unclean shutdown the file is legitimately newer
+    than its last recorded count.
+    """
+
+    VALUE_SIZE = 32
+    MIN_NODES = 1 << 16
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.sizename = filename + ".size"
+        self.f = open(filename, "r+b" if os.path.exists(filename) else "w+b")
+
+        st = os.fstat(self.f.fileno())
+        self.ino = st.st_ino
+        filesize = st.st_size
+        if os.path.exists(self.sizename):
+            with open(self.sizename, "rb") as f:
+                sidecar = f.read()
+            if len(sidecar) != SIDECAR.size:
+                self.f.close()
+                raise ValueError("%s is not a valid node count" % self.sizename)
+            (self.size, ino) = SIDECAR.unpack(sidecar)
+            if ino != self.ino:
+                self.f.close()
+                raise ValueError(
+                    "%s is stale, %s has been replaced since it was written" % (self.sizename, filename))
+            if self.size * self.VALUE_SIZE > filesize:
+                self.f.close()
+                raise ValueError(
+                    "%s is shorter than its recorded %d nodes" % (filename, self.size))
+        else:
+            if filesize % self.VALUE_SIZE:
+                self.f.close()
+                raise ValueError(
+                    "%s is not a whole number of %d byte nodes" % (filename, self.VALUE_SIZE))
+            self.size = filesize // self.VALUE_SIZE
+
+        if self.size and complete_mmr(self.size - 1) != self.size - 1:
+            self.f.close()
+            raise ValueError(
+                "%s holds %d nodes, which is not a complete mmr" % (filename, self.size))
+
+        self._write_size()
+        self.capacity = 0
+        self.mm = None
+        self._map(max(self.size, self.MIN_NODES))
+
+    def _write_size(self):
+        """Atomically record the node count in the sidecar file"""
+        tmpname = self.sizename + ".tmp"
+        with open(tmpname, "wb") as f:
+            f.write(SIDECAR.pack(self.size, self.ino))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpname, self.sizename)
+
+    def _map(self, capacity: int):
+        """Grow the file to capacity nodes and re-map it
+
+        The previous mapping is not closed explicitly, as memoryviews returned
+        by get may still refer to it. It is released once they are.
+        """
+        self.f.truncate(capacity * self.VALUE_SIZE)
+        self.mm = mmap.mmap(self.f.fileno(), capacity * self.VALUE_SIZE)
+        self.capacity = capacity
+
+    def append(self, v):
+        if len(v) != self.VALUE_SIZE:
+            raise ValueError("values must be %d bytes" % self.VALUE_SIZE)
+        if self.size == self.capacity:
+            self._map(self.capacity * 2)
+
+        offset = self.size * self.VALUE_SIZE
+        self.mm[offset:offset + self.VALUE_SIZE] = v
+        self.size += 1
+        return self.size  # index of the *NEXT* item that will be added
+
+    def extend(self, values):
+        for v in values:
+            self.append(v)
+        return self.size  # index of the *NEXT* item that will be added
+
+    def __len__(self):
+        return self.size
+
+    def get(self, i):
+        if i < 0 or i >= self.size:
+            raise IndexError(i)
+        offset = i * self.VALUE_SIZE
+        return memoryview(self.mm)[offset:offset + self.VALUE_SIZE]
+
+    def get_many(self, indices):
+        view = memoryview(self.mm)
+        w = self.VALUE_SIZE
+        values = []
+        for i in indices:
+            if i < 0 or i >= self.size:
+                raise IndexError(i)
+            values.append(view[i * w:(i + 1) * w])
+        return values
+
+    def flush(self):
+        """Make the nodes durable, then record the node count
+
+        This is a recovery point, so it should only be called when the store
+        holds a complete mmr, ie between calls to add_leaf_hash.
+        """
+        self.mm.flush()
+        self._write_size()
+
+    def close(self):
+        """Flush the nodes and truncate the file to the exact node count"""
+        if self.f.closed:
+            return
+        self.mm.flush()
+        self.mm = None
+        self.f.truncate(self.size * self.VALUE_SIZE)
+        self.f.close()
+        self._write_size()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteDB:
+    """A single file sqlite store, with the nodes keyed by mmr index
+
+    Satisfies the same interface as FlatDB. The database is opened in WAL mode.
+    Appends are not committed until the end of a transaction, so that all the
+    nodes added for a leaf, or a batch of leaves, are committed together:
+
+        with db.transaction():
+            add_leaf_hash(db, f)
+
+    A store re-opened after a crash therefore always holds a complete mmr.
+    Values are returned as bytes.
+    """
+
+    # The number of indices read by each get_many statement. Short reads are
+    # padded, so that the same prepared statement is always used.
+    GET_MANY_CHUNK = 32
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes (i INTEGER PRIMARY KEY, v BLOB NOT NULL)")
+        self.conn.commit()
+
+        (last,) = self.conn.execute("SELECT max(i) FROM nodes").fetchone()
+        self.size = 0 if last is None else last + 1
+        if self.size and complete_mmr(self.size - 1) != self.size - 1:
+            self.conn.close()
+            raise ValueError(
+                "%s holds %d nodes, which is not a complete mmr" % (filename, self.size))
+        self.committed = self.size
+
+        self._get_many_sql = "SELECT i, v FROM nodes WHERE i IN (%s)" % ",".join(
+            "?" * self.GET_MANY_CHUNK)
+
+    def append(self, v):
+        self.conn.execute("INSERT INTO nodes (i, v) VALUES (?, ?)", (self.size, v))
+        self.size += 1
+        return self.size  # index of the *NEXT* item that will be added
+
+    def extend(self, values):
+        values = list(values)
+        self.conn.executemany(
+            "INSERT INTO nodes (i, v) VALUES (?, ?)", enumerate(values, self.size))
+        self.size += len(values)
+        return self.size  # index of the *NEXT* item that will be added
+
+    def __len__(self):
+        return self.size
+
+    def get(self, i):
+        row = self.conn.execute("SELECT v FROM nodes WHERE i = ?", (i,)).fetchone()
+        if row is None:
+            raise IndexError(i)
+        return row[0]
+
+    def get_many(self, indices):
+        indices = list(indices)
+        n = self.GET_MANY_CHUNK
+        found = {}
+        for start in range(0, len(indices), n):
+            chunk = indices[start:start + n]
+            chunk += chunk[-1:] * (n - len(chunk))
+            found.update(self.conn.execute(self._get_many_sql, chunk))
+        try:
+            return [found[i] for i in indices]
+        except KeyError as e:
+            raise IndexError(e.args[0])
+
+    def commit(self):
+        self.conn.commit()
+        self.committed = self.size
+
+    def rollback(self):
+        self.conn.rollback()
+        self.size = self.committed
+
+    @contextmanager
+    def transaction(self):
+        """Commit the appends made in the with block, or none of them on error"""
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def close(self):
+        """Commit any outstanding appends and close the database"""
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.rollback()
+        self.close()
+
+
 class KatDB:
     """A fixed size database for providing "known answers" """
 
-    def __init__(self):
+    def __init__(self, hasher=None):
         # A map is used so we can build the tree in layers, with explicit put()
         # calls, for illustrative purposes In a more typical implementation,
         # this would just be a list.
         self.store = {}
+        self.hash_pair = hash_pospair64 if hasher is None else hasher.hash_pospair64
 
     def parent_hash(self, iparent: int, ileft: int, iright: int) -> bytes:
         vleft = self.store[ileft]
         vright = self.store[iright]
-        return hash_pospair64(iparent + 1, vleft, vright)
+        return self.hash_pair(iparent + 1, vleft, vright)
 
     def put(self, i: int, v: bytes):
         self.store[i] = v
@@ -160,6 +432,10 @@ class KatDB:
     def get(self, i) -> bytes:
         return self.store[i]
 
+    def get_many(self, indices):
+        store = self.store
+        return [store[i] for i in indices]
+
     def init_canonical39(self):
         """
         Initialise the db to the canonical MMR(39) which is,
@@ -0,0 +1,84 @@
+"""Pluggable implementations of the node hash, H(pos || a || b)
+
+A backend provides
+
+    hash_pospair64(pos, a, b) -> bytes
+    hash_pospairs64(positions, lefts, rights) -> List[bytes]
+
+Both must produce exactly the same values as algorithms.hash_pospair64. The
+batch form allows callers which have many independent pairs to hash, such as
+all the nodes at one height of a tree, to do so in a single call.
+
+Algorithms that accept a `hasher` use algorithms.hash_pospair64 when none is
+given. These are add_leaf_hash, add_leaf_hashes, included_root,
+consistent_roots and verify_consistent_roots in algorithms, db.KatDB,
+accumulator.Accumulator and ingest.ingest.
+
+A backend reports the hashes it makes to algorithms.hooks, when that is set,
+so that they are counted by instrumentation.
+"""
+import hashlib
+import struct
+from typing import List
+
+import algorithms
+
+
+class Sha256Backend:
+    """SHA-256, the default hash for MMR nodes
+
+    The 8 byte position and the two values are packed into a single buffer,
+    which is hashed with one call. Values which are not VALUE_SIZE bytes
+    objects, eg the memoryviews returned by MmapDB, or values of any other
+    length, are hashed by concatenation instead, so that the result is always
+    identical to algorithms.hash_pospair64.
+    """
+
+    name = "sha256"
+    VALUE_SIZE = 32
+
+    def __init__(self):
+        self._pack = struct.Struct(">Q%ds%ds" % (self.VALUE_SIZE, self.VALUE_SIZE)).pack
+        self._sha256 = hashlib.sha256
+
+    def hash_pospair64(self, pos: int, a: bytes, b: bytes) -> bytes:
+        if algorithms.hooks is not None:
+            algorithms.hooks.hashed(1, 8 + len(a) + len(b))
+        return self._hash_pospair64(pos, a, b)
+
+    def _hash_pospair64(self, pos: int, a: bytes, b: bytes) -> bytes:
+        # struct pads short values and truncates long ones, so only exact
+        # widths may be packed
+        if len(a) == self.VALUE_SIZE and len(b) == self.VALUE_SIZE:
+            try:
+                return self._sha256(self._pack(pos, a, b)).digest()
+            except struct.error:
+                pass
+        return self._sha256(pos.to_bytes(8, byteorder="big", signed=False) + a + b).digest()
+
+    def hash_pospairs64(self, positions: List[int], lefts: List[bytes], rights: List[bytes]) -> List[bytes]:
+        if algorithms.hooks is not None:
+            algorithms.hooks.hashed(
+                len(positions), sum(8 + len(a) + len(b) for (a, b) in zip(lefts, rights)))
+        sha256 = self._sha256
+        pack = self._pack
+        w = self.VALUE_SIZE
+        try:
+            return [sha256(pack(pos, a, b)).digest() if len(a) == w and len(b) == w
+                    else self._hash_pospair64(pos, a, b)
+                    for (pos, a, b) in zip(positions, lefts, rights)]
+        except struct.error:
+            return [self._hash_pospair64(pos, a, b) for (pos, a, b) in zip(positions, lefts, rights)]
+
+
+BACKENDS = {
+    Sha256Backend.name: Sha256Backend,
+}
+
+
+def hash_backend(name: str = Sha256Backend.name):
+    """Returns a new instance of the named hash backend"""
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError("unknown hash backend %s" % name)
@@ -0,0 +1,145 @@
+"""Streaming ingestion of leaf hashes into an MMR
+
+Leaves are consumed from any iterable in batches of bounded size, and each
+batch is added with algorithms.add_leaf_hashes, so memory use is independent
+of the number of leaves. Stores which buffer their writes are flushed
+periodically, and progress is reported to an optional callback.
+
+For stores whose flush is a recovery point, such as db.MmapDB, an interrupted
+ingestion can be resumed: the store re-opens at its size at the last flush,
+and skip_ingested positions a leaf hash file after the leaves it holds.
+
+To backfill a file backed MMR from a file of raw 32 byte leaf hashes, resuming
+any previous, interrupted, backfill
+
+    python ingest.py leaves.bin mmr.bin
+"""
+import sys
+import time
+from collections import namedtuple
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+from algorithms import add_leaf_hashes
+from algorithms import complete_leaf_count
+
+
+IngestProgress = namedtuple("IngestProgress", ["leaves", "size", "seconds", "rate"])
+
+
+def read_leaf_hashes(f, value_size: int = 32) -> Iterator[bytes]:
+    """Yield each raw leaf hash from the binary file object f"""
+    while True:
+        v = f.read(value_size)
+        if not v:
+            return
+        if len(v) != value_size:
+            raise ValueError("trailing %d bytes are not a whole leaf hash" % len(v))
+        yield v
+
+
+def skip_ingested(db, f, value_size: int = 32) -> int:
+    """Seek the raw leaf hash file f past the leaves already in db
+
+    Returns:
+        the number of leaves already in db
+    """
+    done = complete_leaf_count(len(db))
+    f.seek(done * value_size)
+    return done
+
+
+def read_records(f, leaf_hash: Callable, parse: Callable = None) -> Iterator[bytes]:
+    """Yield the leaf hash of each newline delimited record in the file object f
+
+    Args:
+        f: a file object, in text or binary mode
+        leaf_hash: produces the leaf hash for each record, eg db.hash_num64
+        parse: optional, converts each record, without its line ending,
+            before it is hashed. eg int, for use with db.hash_num64
+    """
+    for line in f:
+        record = line.rstrip("\r\n" if isinstance(line, str) else b"\r\n")
+        if parse is not None:
+            record = parse(record)
+        yield leaf_hash(record)
+
+
+def ingest(
+    db,
+    leaves: Iterable[bytes],
+    batchsize: int = 4096,
+    flush_interval: int = 1 << 20,
+    progress: Callable = None,
+    progress_interval: float = 10.0,
+    hasher=None,
+) -> IngestProgress:
+    """Add all of leaves to the MMR in db
+
+    Args:
+        db: an interface satisfying algorithms.add_leaf_hashes. If db has a
+            flush method it is called at least every flush_interval leaves
+            and once all leaves have been added. flush is only ever called
+            between batches, when db holds a complete mmr.
+        leaves: the leaf hash values to add, in order.
+        batchsize (int): the maximum number of leaves held in memory at once.
+        flush_interval (int): the number of leaves between calls to db.flush
+        progress: optional, called with an IngestProgress at most every
+            progress_interval seconds, and once all leaves have been added.
+        progress_interval (float): the minimum seconds between progress calls
+        hasher: optional, a hash_backend passed to add_leaf_hashes
+    Returns:
+        An IngestProgress for the completed ingestion
+    """
+    flush = getattr(db, "flush", None)
+    leaves = iter(leaves)
+
+    start = last = time.monotonic()
+    count = unflushed = 0
+    size = len(db)
+
+    def report():
+        seconds = time.monotonic() - start
+        return IngestProgress(count, size, seconds, count / seconds if seconds else 0.0)
+
+    while True:
+        batch = list(islice(leaves, batchsize))
+        if not batch:
+            break
+
+        size = add_leaf_hashes(db, batch, hasher)
+        count += len(batch)
+        unflushed += len(batch)
+
+        if flush is not None and unflushed >= flush_interval:
+            flush()
+            unflushed = 0
+
+        if progress is not None and time.monotonic() - last >= progress_interval:
+            last = time.monotonic()
+            progress(report())
+
+    if flush is not None and unflushed:
+        flush()
+
+    final = report()
+    if progress is not None:
+        progress(final)
+    return final
+
+
+if __name__ == "__main__":
+    from db import MmapDB
+
+    if len(sys.argv) != 3:
+        print("usage: %s LEAFHASHFILE MMRFILE" % sys.argv[0])
+        sys.exit(1)
+
+    def print_progress(p):
+        print("%d leaves, MMR(%d), %.1fs, %.0f leaves/s" % (p.leaves, p.size - 1, p.seconds, p.rate))
+
+    with open(sys.argv[1], "rb") as f, MmapDB(sys.argv[2]) as db:
+        done = skip_ingested(db, f)
+        if done:
+            print("resuming after %d leaves" % done)
+        ingest(db, read_leaf_hashes(f), progress=print_progress)
@@ -0,0 +1,195 @@
+"""Optional instrumentation of the algorithms: hash counts, store reads and timing
+
+Nothing here is active unless it is explicitly enabled, so there is no cost
+when it is not used. Within
+
+    with instrumented() as inst:
+        ...
+    print(inst.report())
+
+the calls to add_leaf_hash, add_leaf_hashes, inclusion_proof,
+consistency_proof and verify_consistent_roots are each timed as a span. Within
+a span, node hashes are counted along with the bytes hashed, and the reads and
+writes of the db passed to the call are counted.
+
+The algorithms call explicit hook points, so the calls are seen however the
+functions were imported, eg by leaves, ingest, path_cache or db.FlatDB. The
+hashes made by algorithms.hash_pospair64, and by the hash_backend hashers, are
+counted wherever they are called from, including the hashes made by
+accumulator, range_proofs and batch_verify within a span. The hooks are only
+set, as algorithms.hooks, while any with block, on any thread, is open.
+Otherwise each hook point is a single check against None. Each event is
+attributed to the innermost block open on the calling thread, so concurrent
+blocks on different threads each report only their own thread's calls. Calls
+from a thread with no open block pass straight through.
+
+A sink, if given, is called with the name and counters of every completed span.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import algorithms
+
+
+SPANS = ("add_leaf_hash", "add_leaf_hashes", "inclusion_proof", "consistency_proof",
+         "verify_consistent_roots")
+COUNTERS = ("calls", "hashes", "hashed_bytes", "reads", "writes", "seconds")
+
+# The spans whose first argument is the db
+DB_SPANS = ("add_leaf_hash", "add_leaf_hashes", "inclusion_proof", "consistency_proof")
+
+# The hooks are installed once, however many blocks are open
+_lock = threading.Lock()
+_refcount = 0
+
+# The stack of Instrumentation blocks open on each thread
+_local = threading.local()
+
+
+def _current():
+    """Returns the innermost Instrumentation open on this thread, or None"""
+    insts = getattr(_local, "insts", None)
+    return insts[-1] if insts else None
+
+
+class InstrumentedDB:
+    """Counts the reads and writes made to db in the current span"""
+
+    def __init__(self, db, inst: "Instrumentation"):
+        self.db = db
+        self.inst = inst
+
+    def get(self, i):
+        self.inst.count("reads", 1)
+        return self.db.get(i)
+
+    def append(self, v):
+        self.inst.count("writes", 1)
+        return self.db.append(v)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if name == "get_many":
+            def get_many(indices):
+                indices = list(indices)
+                self.inst.count("reads", len(indices))
+                return attr(indices)
+            return get_many
+        if name == "extend":
+            def extend(values):
+                values = list(values)
+                self.inst.count("writes", len(values))
+                return attr(values)
+            return extend
+        return attr
+
+    def __len__(self):
+        return len(self.db)
+
+
+class Instrumentation:
+    """Accumulates the counters for each span name
+
+    An instance is used by the single thread which opened its block.
+    """
+
+    def __init__(self, sink: Callable = None):
+        self.sink = sink
+        self.totals = {}
+        self.stack = []
+        # The span name whose call is being re-made, see _Hooks.wants_span
+        self.entering = None
+
+    def count(self, counter: str, n):
+        if self.stack:
+            self.stack[-1][1][counter] += n
+
+    @contextmanager
+    def span(self, name: str):
+        counters = dict((c, 0) for c in COUNTERS)
+        counters["calls"] = 1
+        self.stack.append((name, counters))
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            counters["seconds"] = time.perf_counter() - start
+            self.stack.pop()
+
+            totals = self.totals.setdefault(name, dict((c, 0) for c in COUNTERS))
+            for c in COUNTERS:
+                totals[c] += counters[c]
+            if self.sink is not None:
+                self.sink(name, counters)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Returns the total counters for each span name"""
+        return dict((name, dict(totals)) for (name, totals) in self.totals.items())
+
+
+class _Hooks:
+    """The hook points called by the algorithms while any block is open"""
+
+    def wants_span(self, name: str) -> bool:
+        """Returns True if the call to name should be re-made through span
+
+        False if there is no block open on this thread, or if this is the call
+        made by span itself.
+        """
+        inst = _current()
+        if inst is None:
+            return False
+        if inst.entering == name:
+            inst.entering = None
+            return False
+        return True
+
+    def span(self, name: str, fn: Callable, *args):
+        """Call fn(*args) within a span, counting the reads and writes of its db"""
+        inst = _current()
+        with inst.span(name):
+            if name in DB_SPANS:
+                args = (InstrumentedDB(args[0], inst),) + args[1:]
+            inst.entering = name
+            return fn(*args)
+
+    def hashed(self, count: int, nbytes: int):
+        inst = _current()
+        if inst is not None:
+            inst.count("hashes", count)
+            inst.count("hashed_bytes", nbytes)
+
+
+_hooks = _Hooks()
+
+
+def _install():
+    global _refcount
+    with _lock:
+        if _refcount == 0:
+            algorithms.hooks = _hooks
+        _refcount += 1
+
+
+def _uninstall():
+    global _refcount
+    with _lock:
+        _refcount -= 1
+        if _refcount == 0:
+            algorithms.hooks = None
+
+
+@contextmanager
+def instrumented(sink: Callable = None):
+    """Instrument the calls made by this thread for the duration of the with block"""
+    inst = Instrumentation(sink)
+    _install()
+    insts = _local.__dict__.setdefault("insts", [])
+    insts.append(inst)
+    try:
+        yield inst
+    finally:
+        insts.pop()
+        _uninstall()
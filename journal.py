@@ -0,0 +1,171 @@
+"""A crash safe file store, which journals appends before writing them
+
+If a writer dies part way through add_leaf_hash, a plain file store can be
+left holding a leaf without its interior nodes, which is not a valid MMR.
+JournaledDB only ever makes complete node groups durable.
+
+The store recognises the end of each leaf's node group as the point at which
+its size is a complete mmr again. Completed groups are held in memory until
+group_commit leaves have accumulated. They are then written to the journal as
+a single checksummed record, the journal is fsync'd, and only then are the
+nodes written to the data file. Larger group_commit values trade the latency
+before a leaf is durable for fewer fsyncs, and so higher append rates.
+
+Once the journal exceeds checkpoint_bytes, the data file is fsync'd and the
+journal is emptied.
+
+On open, the valid records in the journal are replayed into the data file,
+stopping at the first torn record, and the data file is then truncated to the
+last complete mmr size.
+
+    data:    32 byte nodes, in mmr index order
+    journal: records of first index, node count, nodes, crc32
+"""
+import os
+import struct
+import zlib
+
+from algorithms import complete_leaf_count
+from algorithms import complete_mmr
+from algorithms import mmr_index
+
+
+VALUE_SIZE = 32
+RECORD_HEADER = struct.Struct(">QI")
+RECORD_CRC = struct.Struct(">I")
+
+
+class JournaledDB:
+    """A crash safe file store satisfying the same interface as FlatDB"""
+
+    def __init__(self, filename: str, group_commit: int = 64, checkpoint_bytes: int = 1 << 24):
+        self.filename = filename
+        self.journalname = filename + ".journal"
+        self.group_commit = group_commit
+        self.checkpoint_bytes = checkpoint_bytes
+
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        self.journalfd = os.open(self.journalname, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+        # written is the number of nodes in the data file. The nodes from
+        # there up to size are held in tail, the first closed of which belong
+        # to complete leaves.
+        self.written = self.recover()
+        self.size = self.written
+        self.tail = []
+        self.closed = 0
+        self.leaves = 0
+        self.journalsize = 0
+
+    def recover(self) -> int:
+        """Replay the journal and truncate the data file to a complete mmr
+
+        Returns the number of nodes in the recovered data file.
+        """
+        journal = b""
+        while True:
+            chunk = os.read(self.journalfd, 1 << 20)
+            if not chunk:
+                break
+            journal += chunk
+
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(journal):
+            (start, count) = RECORD_HEADER.unpack_from(journal, offset)
+            end = offset + RECORD_HEADER.size + count * VALUE_SIZE
+            if end + RECORD_CRC.size > len(journal):
+                break
+            (crc,) = RECORD_CRC.unpack_from(journal, end)
+            if crc != zlib.crc32(journal[offset:end]):
+                break
+            os.pwrite(self.fd, journal[offset + RECORD_HEADER.size:end], start * VALUE_SIZE)
+            offset = end + RECORD_CRC.size
+
+        size = mmr_index(complete_leaf_count(os.fstat(self.fd).st_size // VALUE_SIZE))
+        os.ftruncate(self.fd, size * VALUE_SIZE)
+        os.fsync(self.fd)
+        os.ftruncate(self.journalfd, 0)
+        os.fsync(self.journalfd)
+        return size
+
+    def append(self, v):
+        if len(v) != VALUE_SIZE:
+            raise ValueError("values must be %d bytes" % VALUE_SIZE)
+        self.tail.append(bytes(v))
+        self.size += 1
+
+        if complete_mmr(self.size - 1) == self.size - 1:
+            self.closed = len(self.tail)
+            self.leaves += 1
+            if self.leaves >= self.group_commit:
+                self.commit()
+
+        return self.size  # index of the *NEXT* item that will be added
+
+    def extend(self, values):
+        for v in values:
+            self.append(v)
+        return self.size  # index of the *NEXT* item that will be added
+
+    def __len__(self):
+        return self.size
+
+    def get(self, i):
+        if i < 0 or i >= self.size:
+            raise IndexError(i)
+        if i >= self.written:
+            return self.tail[i - self.written]
+        return os.pread(self.fd, VALUE_SIZE, i * VALUE_SIZE)
+
+    def get_many(self, indices):
+        return [self.get(i) for i in indices]
+
+    def commit(self):
+        """Make the nodes of all complete leaves durable"""
+        if not self.closed:
+            return
+
+        nodes = b"".join(self.tail[:self.closed])
+        record = RECORD_HEADER.pack(self.written, self.closed) + nodes
+        record += RECORD_CRC.pack(zlib.crc32(record))
+        os.write(self.journalfd, record)
+        os.fsync(self.journalfd)
+
+        os.pwrite(self.fd, nodes, self.written * VALUE_SIZE)
+        self.written += self.closed
+        del self.tail[:self.closed]
+        self.closed = 0
+        self.leaves = 0
+
+        self.journalsize += len(record)
+        if self.journalsize >= self.checkpoint_bytes:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Make the data file durable and empty the journal"""
+        os.fsync(self.fd)
+        os.ftruncate(self.journalfd, 0)
+        os.fsync(self.journalfd)
+        self.journalsize = 0
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        """Commit the complete leaves and close the store
+
+        The nodes of an incomplete leaf are discarded.
+        """
+        if self.fd is None:
+            return
+        self.commit()
+        self.checkpoint()
+        os.close(self.fd)
+        os.close(self.journalfd)
+        self.fd = self.journalfd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,57 @@
+"""A leaf addressed layer over the algorithms
+
+Clients typically address entries by their leaf ordinal e, and the size of a
+log by its count of leaves n, while the algorithms take mmr indices. The
+conversions are closed form: leaf e is at mmr index 2e - popcount(e), which is
+also the number of nodes in the MMR of e leaves. So the MMR of n leaves is
+MMR(mmr_index(n) - 1).
+
+For bulk conversion of leaf ordinals, see algorithms_vectorized.mmr_indices.
+"""
+from typing import List
+
+from algorithms import add_leaf_hash
+from algorithms import complete_leaf_count
+from algorithms import consistency_proof
+from algorithms import inclusion_proof
+from algorithms import mmr_index
+
+
+def size_leaf_count(size: int) -> int:
+    """Returns the number of leaves in the MMR of size nodes
+
+    Raises:
+        ValueError: if size is not a complete mmr size
+    """
+    e = complete_leaf_count(size)
+    if mmr_index(e) != size:
+        raise ValueError("%d is not a complete mmr size" % size)
+    return e
+
+
+def leaf_mmr(n: int) -> int:
+    """Returns the last mmr index of the MMR with n leaves"""
+    if n < 1:
+        raise ValueError("an mmr has at least one leaf")
+    return mmr_index(n) - 1
+
+
+def add_leaf(db, f: bytes) -> int:
+    """Add the leaf hash f to db, returning its leaf ordinal"""
+    e = size_leaf_count(len(db))
+    add_leaf_hash(db, f)
+    return e
+
+
+def inclusion_proof_by_leaf(db, e: int, n: int) -> List[bytes]:
+    """Returns the inclusion proof of leaf e in the MMR of n leaves"""
+    if e < 0 or e >= n:
+        raise ValueError("leaf %d is not in the mmr of %d leaves" % (e, n))
+    return inclusion_proof(db, mmr_index(e), leaf_mmr(n))
+
+
+def consistency_proof_by_leaves(db, nfrom: int, nto: int) -> List[List[bytes]]:
+    """Returns the proof that the MMR of nto leaves extends the MMR of nfrom leaves"""
+    if nfrom > nto:
+        raise ValueError("%d leaves can not be extended to %d" % (nfrom, nto))
+    return consistency_proof(db, leaf_mmr(nfrom), leaf_mmr(nto))
@@ -0,0 +1,220 @@
+"""A segmented on disk store, which splits the MMR into fixed height massifs
+
+Massif k holds the nodes for the leaves [k * 2^h, (k + 1) * 2^h). Those are
+the nodes of the perfect subtree of height h over the leaves, followed by the
+spine nodes which merge the subtree with the earlier peaks. So massif k holds
+the mmr indices [mmr_index(k * 2^h), mmr_index((k + 1) * 2^h)), and the massif
+for any index is found by arithmetic.
+
+Each massif is a separate file with a header recording the height, the first
+mmr index, and the peaks of the MMR which precedes it. The spine nodes merge
+only with those peaks, so appending never reads an earlier massif. Once its
+last node is added, a massif is sealed: the file is made read only and never
+changes again, so its content can be cached indefinitely.
+
+Nodes are written to the file a whole leaf group at a time, each group in a
+single write, so a killed writer leaves at most one torn group at the end of
+the last massif. On open, that massif is truncated back to its last complete
+mmr size, and the nodes of any incomplete leaf are lost, as they are on close.
+
+    header: magic "MMRM", version, height, first index, peak count, peaks
+    nodes:  32 bytes each, in mmr index order
+"""
+import os
+import struct
+from collections import OrderedDict
+
+from algorithms import complete_leaf_count
+from algorithms import complete_mmr
+from algorithms import mmr_index
+from algorithms import peaks
+
+
+HEADER = struct.Struct(">4sBBxxQI4x")
+MAGIC = b"MMRM"
+VERSION = 1
+VALUE_SIZE = 32
+
+
+def massif_index(i: int, height: int) -> int:
+    """Returns the index of the massif, of the given height, which holds mmr index i"""
+    return complete_leaf_count(i) >> height
+
+
+def massif_range(k: int, height: int):
+    """Returns the first mmr index of massif k, and the first index after it"""
+    return mmr_index(k << height), mmr_index((k + 1) << height)
+
+
+def header_complete(data: bytes) -> bool:
+    """Returns True if data holds at least a whole massif header, with its peaks"""
+    if len(data) < HEADER.size:
+        return False
+    npeaks = HEADER.unpack_from(data)[4]
+    return len(data) >= HEADER.size + npeaks * VALUE_SIZE
+
+
+class MassifDB:
+    """A segmented file store satisfying the same interface as FlatDB"""
+
+    def __init__(self, directory: str, height: int = 14, cache_massifs: int = 16):
+        self.directory = directory
+        self.height = height
+        self.cache_massifs = cache_massifs
+        self.sealed = OrderedDict()
+
+        os.makedirs(directory, exist_ok=True)
+        massifs = sorted(
+            int(name[:-len(".mmr")]) for name in os.listdir(directory) if name.endswith(".mmr"))
+
+        # A crash just after the next massif was created can leave its header
+        # torn. No node can have been written to it, so it is treated as not
+        # yet started, and is started again by the next append.
+        while massifs:
+            with open(self.filename(massifs[-1]), "rb") as f:
+                data = f.read()
+            if header_complete(data):
+                break
+            os.remove(self.filename(massifs.pop()))
+
+        if not massifs:
+            self._start(0, [])
+            return
+
+        k = massifs[-1]
+        (height, first, basepeaks) = self._read_header(k, data)
+        if height != self.height:
+            raise ValueError("%s has height %d, not %d" % (self.filename(k), height, self.height))
+
+        # Drop any torn node, and the nodes of an incomplete leaf, left by a
+        # writer which did not close the massif.
+        offset = HEADER.size + len(basepeaks) * VALUE_SIZE
+        size = mmr_index(complete_leaf_count(first + (len(data) - offset) // VALUE_SIZE))
+        if offset + (size - first) * VALUE_SIZE < len(data):
+            os.truncate(self.filename(k), offset + (size - first) * VALUE_SIZE)
+
+        self.k = k
+        self.first, self.end = massif_range(k, self.height)
+        self.basepeaks = dict(zip(peaks(self.first - 1), basepeaks))
+        self.nodes = bytearray(data[offset:offset + (size - self.first) * VALUE_SIZE])
+        self.pending = bytearray()
+        self.size = size
+        self.f = None
+        if self.size < self.end:
+            self.f = open(self.filename(k), "ab", buffering=0)
+        elif os.stat(self.filename(k)).st_mode & 0o222:
+            # The writer stopped after the last node, but before sealing
+            os.chmod(self.filename(k), 0o444)
+
+    def filename(self, k: int) -> str:
+        return os.path.join(self.directory, "%016d.mmr" % k)
+
+    def _read_header(self, k: int, data: bytes):
+        if not header_complete(data):
+            raise ValueError("%s has a truncated header" % self.filename(k))
+        (magic, version, height, first, npeaks) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d massif" % (self.filename(k), VERSION))
+        o = HEADER.size
+        basepeaks = [bytes(data[o + j * VALUE_SIZE:o + (j + 1) * VALUE_SIZE]) for j in range(npeaks)]
+        return height, first, basepeaks
+
+    def _start(self, k: int, basepeaks):
+        """Start massif k, whose preceding MMR has the peak values basepeaks"""
+        self.k = k
+        self.first, self.end = massif_range(k, self.height)
+        self.basepeaks = dict(zip(peaks(self.first - 1), basepeaks))
+        self.nodes = bytearray()
+        self.pending = bytearray()
+        self.size = self.first
+
+        self.f = open(self.filename(k), "xb", buffering=0)
+        self.f.write(HEADER.pack(MAGIC, VERSION, self.height, self.first, len(basepeaks))
+                     + b"".join(basepeaks))
+
+    def _seal(self):
+        self.f.close()
+        self.f = None
+        os.chmod(self.filename(self.k), 0o444)
+        self._cache(self.k, bytes(self.nodes))
+
+    def _cache(self, k: int, nodes: bytes):
+        self.sealed[k] = nodes
+        self.sealed.move_to_end(k)
+        while len(self.sealed) > self.cache_massifs:
+            self.sealed.popitem(last=False)
+
+    def _sealed_nodes(self, k: int) -> bytes:
+        nodes = self.sealed.get(k)
+        if nodes is not None:
+            self.sealed.move_to_end(k)
+            return nodes
+
+        with open(self.filename(k), "rb") as f:
+            data = f.read()
+        (_, _, basepeaks) = self._read_header(k, data)
+        nodes = data[HEADER.size + len(basepeaks) * VALUE_SIZE:]
+        self._cache(k, nodes)
+        return nodes
+
+    def append(self, v):
+        if len(v) != VALUE_SIZE:
+            raise ValueError("values must be %d bytes" % VALUE_SIZE)
+
+        if self.f is None:
+            # The current massif is sealed, its peaks are the base of the next
+            self._start(self.k + 1, [self.get(p) for p in peaks(self.size - 1)])
+
+        self.nodes += v
+        self.pending += v
+        self.size += 1
+
+        if complete_mmr(self.size - 1) == self.size - 1:
+            # The leaf group is complete, write it as one
+            self.f.write(self.pending)
+            self.pending = bytearray()
+
+        if self.size == self.end:
+            self._seal()
+
+        return self.size  # index of the *NEXT* item that will be added
+
+    def extend(self, values):
+        for v in values:
+            self.append(v)
+        return self.size  # index of the *NEXT* item that will be added
+
+    def __len__(self):
+        return self.size
+
+    def get(self, i):
+        if i < 0 or i >= self.size:
+            raise IndexError(i)
+
+        if i >= self.first:
+            o = (i - self.first) * VALUE_SIZE
+            return bytes(self.nodes[o:o + VALUE_SIZE])
+
+        v = self.basepeaks.get(i)
+        if v is not None:
+            return v
+
+        k = massif_index(i, self.height)
+        o = (i - massif_range(k, self.height)[0]) * VALUE_SIZE
+        return self._sealed_nodes(k)[o:o + VALUE_SIZE]
+
+    def flush(self):
+        if self.f is not None:
+            self.f.flush()
+
+    def close(self):
+        """Close the store. The nodes of an incomplete leaf are discarded"""
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
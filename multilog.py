@@ -0,0 +1,309 @@
+"""Many independent MMRs, hosted over a shared storage pool
+
+Each log is routed, by its id, to one of a fixed number of shards. A shard is
+a single append only arena of 32 byte node values, held in memory or in one
+file, which is shared by all of its logs. Per log, only the arena slot of each
+mmr index is kept, in a compact array.
+
+Reads of every log go through one node cache, so that a single byte budget
+bounds the memory used for caching across all the logs. As for
+node_cache.CachingDB, each entry is charged an estimate of its full memory
+cost, not only its value. Appends to a shard are
+serialised by its lock, so appends to logs on different shards may proceed
+concurrently from a thread pool.
+
+A file backed shard also records each contiguous run of slots it writes, in
+filename + ".runs", as the log id, the first mmr index, the first slot and the
+count. Every extend writes a single run, after its values, so the record costs
+one small append per batch. A pool re-opened over an existing directory
+rebuilds the slot tables from the runs, stopping at the first torn record, and
+then truncates each log to its last complete mmr. The log ids of a file backed
+pool must be literals, eg str, bytes, int or tuples of them, so that they can
+be recorded by their repr.
+
+    runs: records of first index, first slot, count, id length, repr(log id), crc32
+"""
+import ast
+import os
+import struct
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+import algorithms
+from algorithms import complete_leaf_count
+from algorithms import mmr_index
+
+
+VALUE_SIZE = 32
+RUN_HEADER = struct.Struct(">QQIH")
+RUN_CRC = struct.Struct(">I")
+
+
+class _Shard:
+    """An append only arena of fixed width node values"""
+
+    def __init__(self, filename: str = None):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.fd = None
+        self.runsfd = None
+        self.arena = bytearray()
+        if filename is not None:
+            self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+            self.runsfd = os.open(filename + ".runs", os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            # Values written without their run are unreferenced, but are never
+            # overwritten
+            self.count = -(-os.fstat(self.fd).st_size // VALUE_SIZE)
+
+    def write(self, log_id: Hashable, first: int, values: List[bytes]) -> int:
+        """Write values to consecutive slots, returning the first. The caller holds the lock
+
+        For a file backed shard, the run is recorded once the values are written.
+        """
+        slot = self.count
+        data = b"".join(values)
+        if len(data) != len(values) * VALUE_SIZE:
+            raise ValueError("values must be %d bytes" % VALUE_SIZE)
+        if self.fd is not None:
+            os.pwrite(self.fd, data, slot * VALUE_SIZE)
+            ident = repr(log_id).encode()
+            record = RUN_HEADER.pack(first, slot, len(values), len(ident)) + ident
+            os.write(self.runsfd, record + RUN_CRC.pack(zlib.crc32(record)))
+        else:
+            self.arena += data
+        self.count += len(values)
+        return slot
+
+    def runs(self):
+        """Yields (log_id, first, slot, count) for each recorded run, in order
+
+        A torn record, and anything after it, is removed from the runs file.
+        """
+        data = b""
+        while True:
+            chunk = os.pread(self.runsfd, 1 << 20, len(data))
+            if not chunk:
+                break
+            data += chunk
+
+        offset = 0
+        while offset + RUN_HEADER.size <= len(data):
+            (first, slot, count, idlen) = RUN_HEADER.unpack_from(data, offset)
+            end = offset + RUN_HEADER.size + idlen
+            if end + RUN_CRC.size > len(data):
+                break
+            (crc,) = RUN_CRC.unpack_from(data, end)
+            if crc != zlib.crc32(data[offset:end]):
+                break
+            log_id = ast.literal_eval(data[offset + RUN_HEADER.size:end].decode())
+            yield (log_id, first, slot, count)
+            offset = end + RUN_CRC.size
+
+        if offset < len(data):
+            os.ftruncate(self.runsfd, offset)
+
+    def read(self, slot: int) -> bytes:
+        if self.fd is not None:
+            return os.pread(self.fd, VALUE_SIZE, slot * VALUE_SIZE)
+        offset = slot * VALUE_SIZE
+        return bytes(self.arena[offset:offset + VALUE_SIZE])
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            os.close(self.runsfd)
+            self.fd = self.runsfd = None
+
+
+def _literal(log_id: Hashable):
+    """Returns the log id recovered from its repr, or None if it is not a literal"""
+    try:
+        return ast.literal_eval(repr(log_id))
+    except (ValueError, SyntaxError):
+        return None
+
+
+class SharedNodeCache:
+    """A least recently used cache of node values, for all logs, with a byte budget"""
+
+    # CachingDB.ENTRY_OVERHEAD, plus the (log id, index) key tuple
+    ENTRY_OVERHEAD = 232
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.lru = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            v = self.lru.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self.lru.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key, v: bytes):
+        cost = len(v) + self.ENTRY_OVERHEAD
+        if cost > self.budget:
+            return
+        with self.lock:
+            if key in self.lru:
+                return
+            self.lru[key] = v
+            self.bytes += cost
+            while self.bytes > self.budget:
+                (_, evicted) = self.lru.popitem(last=False)
+                self.bytes -= len(evicted) + self.ENTRY_OVERHEAD
+
+
+class LogDB:
+    """One log of a LogPool. Satisfies the same interface as FlatDB"""
+
+    def __init__(self, log_id: Hashable, shard: _Shard, cache: SharedNodeCache):
+        self.log_id = log_id
+        self.shard = shard
+        self.cache = cache
+        self.slots = array("Q")
+
+    def append(self, v):
+        return self.extend([v])
+
+    def extend(self, values):
+        values = [bytes(v) for v in values]
+        slot = self.shard.write(self.log_id, len(self.slots), values)
+        self.slots.extend(range(slot, slot + len(values)))
+        return len(self.slots)  # index of the *NEXT* item that will be added
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get(self, i):
+        if i < 0 or i >= len(self.slots):
+            raise IndexError(i)
+        key = (self.log_id, i)
+        v = self.cache.get(key)
+        if v is None:
+            v = self.shard.read(self.slots[i])
+            self.cache.put(key, v)
+        return v
+
+    def get_many(self, indices):
+        return [self.get(i) for i in indices]
+
+
+class LogPool:
+    """Hosts many MMRs, addressed by log id, over a fixed number of shards"""
+
+    def __init__(self, directory: str = None, shards: int = 16, budget: int = 64 << 20):
+        """
+        Args:
+            directory (str): if provided, each shard is a file in directory,
+                otherwise the shards are held in memory. The logs of an
+                existing pool in directory are re-opened.
+            shards (int): the number of shards the logs are spread across.
+                An existing pool must be re-opened with the same number.
+            budget (int): the maximum estimated bytes of memory used to cache
+                nodes, across all logs, including SharedNodeCache.ENTRY_OVERHEAD
+                for each.
+        """
+        self.directory = directory
+        self.cache = SharedNodeCache(budget)
+        self.logs = {}
+        self.lock = threading.Lock()
+        if directory is None:
+            self.shards = [_Shard() for _ in range(shards)]
+            return
+
+        existing = [name for name in os.listdir(directory) if name.endswith(".bin")]
+        if existing and len(existing) != shards:
+            raise ValueError("%s holds a pool of %d shards, not %d" % (directory, len(existing), shards))
+        self.shards = [
+            _Shard(os.path.join(directory, "shard-%04d.bin" % k)) for k in range(shards)]
+
+        for (k, shard) in enumerate(self.shards):
+            for (log_id, first, slot, count) in shard.runs():
+                if self.shard_index(log_id) != k:
+                    raise ValueError("log %r is recorded in the wrong shard, %d" % (log_id, k))
+                db = self.db(log_id)
+                if first > len(db.slots):
+                    raise ValueError("log %r is missing the nodes before %d" % (log_id, first))
+                # A run which starts before the end of the log was written
+                # after an earlier re-open discarded an incomplete leaf
+                del db.slots[first:]
+                db.slots.extend(range(slot, slot + count))
+
+        for db in self.logs.values():
+            del db.slots[mmr_index(complete_leaf_count(len(db.slots))):]
+
+    def shard_index(self, log_id: Hashable) -> int:
+        """Returns the shard for log_id. This is stable between processes"""
+        return zlib.crc32(repr(log_id).encode()) % len(self.shards)
+
+    def db(self, log_id: Hashable) -> LogDB:
+        """Returns the db for log_id, creating an empty log if necessary"""
+        db = self.logs.get(log_id)
+        if db is None:
+            with self.lock:
+                db = self.logs.get(log_id)
+                if db is None:
+                    if self.directory is not None and _literal(log_id) != log_id:
+                        raise ValueError("%r can not be recorded, it is not a literal" % (log_id,))
+                    db = self.logs[log_id] = LogDB(
+                        log_id, self.shards[self.shard_index(log_id)], self.cache)
+        return db
+
+    def add_leaf_hash(self, log_id: Hashable, f: bytes) -> int:
+        # add_leaf_hashes writes the leaf and its parents as a single run
+        return self.add_leaf_hashes(log_id, [f])
+
+    def add_leaf_hashes(self, log_id: Hashable, leaves: List[bytes]) -> int:
+        db = self.db(log_id)
+        with db.shard.lock:
+            return algorithms.add_leaf_hashes(db, leaves)
+
+    def inclusion_proof(self, log_id: Hashable, i: int, ix: int) -> List[bytes]:
+        return algorithms.inclusion_proof(self.logs[log_id], i, ix)
+
+    def consistency_proof(self, log_id: Hashable, ifrom: int, ito: int) -> List[List[bytes]]:
+        return algorithms.consistency_proof(self.logs[log_id], ifrom, ito)
+
+    def append_many(self, items: Iterable[Tuple[Hashable, bytes]], executor=None) -> Dict[Hashable, int]:
+        """Add leaf hashes to many logs
+
+        The leaves for each log are added in the order given. With an
+        executor, typically a concurrent.futures.ThreadPoolExecutor, the leaves
+        for each shard are added by a separate task.
+
+        Returns:
+            the mmr size of each log appended to
+        """
+        byshard = {}
+        for (log_id, f) in items:
+            byshard.setdefault(self.shard_index(log_id), {}).setdefault(log_id, []).append(f)
+
+        def append_shard(logs):
+            return [(log_id, self.add_leaf_hashes(log_id, leaves)) for (log_id, leaves) in logs.items()]
+
+        if executor is None:
+            results = map(append_shard, byshard.values())
+        else:
+            results = executor.map(append_shard, byshard.values())
+        return dict(size for sizes in results for size in sizes)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,98 @@
+"""A read-through node cache for serving proofs
+
+Every proof ends in the upper levels of the tree, so the nodes near the peaks
+are read by almost every request. CachingDB pins every node at or above a
+configured height, and holds the lower nodes in a least recently used cache
+with a byte budget. Nodes are immutable once added, so no invalidation is
+required.
+
+The budget is charged an estimate of the full memory cost of each cached node,
+ENTRY_OVERHEAD bytes for the key, the bytes object and the OrderedDict entry,
+plus the value itself. The pinned nodes are not charged to the budget and are
+never evicted. Their number is bounded by the MMR instead, at 1 / 2^pin_height
+of its nodes, and their estimated cost is reported as pinnedbytes.
+"""
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from algorithms import index_height
+
+
+class CachingDB:
+    """Wraps any db providing get, adding a cache. append, extend and len pass through"""
+
+    # Measured with tracemalloc for 32 byte values and int keys on CPython 3
+    ENTRY_OVERHEAD = 176
+
+    def __init__(self, db, pin_height: int = 10, budget: int = 64 << 20):
+        """
+        Args:
+            db: the store to read through to
+            pin_height (int): nodes of this height or greater are never evicted.
+                They are 1 / 2^pin_height of all nodes.
+            budget (int): the maximum estimated bytes of memory used to cache
+                the lower nodes, including ENTRY_OVERHEAD for each.
+        """
+        self.db = db
+        self.pin_height = pin_height
+        self.budget = budget
+
+        self.pinned = {}
+        self.pinnedbytes = 0
+        self.lru = OrderedDict()
+        self.lrubytes = 0
+
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, i):
+        g = index_height(i)
+
+        if g >= self.pin_height:
+            v = self.pinned.get(i)
+            if v is None:
+                v = self.pinned[i] = bytes(self.db.get(i))
+                self.pinnedbytes += len(v) + self.ENTRY_OVERHEAD
+                self.misses[g] = self.misses.get(g, 0) + 1
+            else:
+                self.hits[g] = self.hits.get(g, 0) + 1
+            return v
+
+        v = self.lru.get(i)
+        if v is not None:
+            self.lru.move_to_end(i)
+            self.hits[g] = self.hits.get(g, 0) + 1
+            return v
+
+        self.misses[g] = self.misses.get(g, 0) + 1
+        v = bytes(self.db.get(i))
+        cost = len(v) + self.ENTRY_OVERHEAD
+        if cost > self.budget:
+            return v
+
+        self.lru[i] = v
+        self.lrubytes += cost
+        while self.lrubytes > self.budget:
+            (_, evicted) = self.lru.popitem(last=False)
+            self.lrubytes -= len(evicted) + self.ENTRY_OVERHEAD
+        return v
+
+    def append(self, v):
+        return self.db.append(v)
+
+    def extend(self, values):
+        return self.db.extend(values)
+
+    def __len__(self):
+        return len(self.db)
+
+    def stats(self) -> Dict[int, Tuple[int, int]]:
+        """Returns the (hits, misses) for each node height read"""
+        heights = sorted(set(self.hits) | set(self.misses))
+        return dict((g, (self.hits.get(g, 0), self.misses.get(g, 0))) for g in heights)
+
+    def hit_rate(self, g: int) -> float:
+        """Returns the fraction of reads for nodes of height g which hit the cache"""
+        hits = self.hits.get(g, 0)
+        reads = hits + self.misses.get(g, 0)
+        return hits / reads if reads else 0.0
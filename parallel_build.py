@@ -0,0 +1,221 @@
+"""Construction of an MMR from scratch using many processes
+
+The leaves are partitioned into aligned blocks of 2^h leaves. The nodes of the
+perfect subtree over each block are contiguous in the MMR, starting at the mmr
+index of the block's first leaf, and they depend on nothing outside the block.
+So each block is hashed independently, by a worker, directly into its place in
+the output file. The parent then stitches the blocks together, adding the
+nodes above height h and the nodes for any trailing partial block.
+
+Memory is bounded by the blocks in flight, not by the leaf count. build reads
+its leaves from any iterable, and submits at most `window` blocks before
+collecting the root of the oldest. build_file goes further: each worker is
+given only (base, start, count) and reads its own block from a file of leaf
+hashes, so the parent never holds the leaves at all.
+
+The output is a file of fixed width nodes, identical to that produced by
+add_leaf_hash, which can be opened with db.MmapDB.
+"""
+import os
+from collections import deque
+from itertools import islice
+from typing import Iterable
+
+from algorithms import hash_pospair64
+from algorithms import index_height
+from algorithms import mmr_index
+
+
+VALUE_SIZE = 32
+
+# The block height used when the leaf count is not known in advance
+DEFAULT_BLOCKHEIGHT = 12
+
+
+def build_subtree(filename: str, base: int, leaves: bytes) -> bytes:
+    """Hash the perfect subtree over leaves into the file at mmr index base
+
+    Args:
+        filename (str): the output file
+        base (int): the mmr index of the first leaf
+        leaves (bytes): the concatenated leaf hashes. Their count must be a power of 2.
+    Returns:
+        The root of the subtree
+    """
+    nodes = []
+    for o in range(0, len(leaves), VALUE_SIZE):
+        # Within the subtree, the local indices have the same heights as the
+        # indices of an mmr whose first leaf is at 0.
+        nodes.append(leaves[o:o + VALUE_SIZE])
+        g = 0
+        i = len(nodes)
+        while index_height(i) > g:
+            nodes.append(hash_pospair64(base + i + 1, nodes[i - (2 << g)], nodes[i - 1]))
+            i += 1
+            g += 1
+
+    fd = os.open(filename, os.O_WRONLY)
+    try:
+        os.pwrite(fd, b"".join(nodes), base * VALUE_SIZE)
+    finally:
+        os.close(fd)
+
+    return nodes[-1]
+
+
+def build_subtree_file(filename: str, base: int, leafname: str, start: int, count: int) -> bytes:
+    """Hash the perfect subtree over the leaves [start, start + count) of leafname
+
+    As build_subtree, but the worker reads its own block from the file of
+    concatenated leaf hashes, so only its position is sent to it.
+    """
+    fd = os.open(leafname, os.O_RDONLY)
+    try:
+        leaves = os.pread(fd, count * VALUE_SIZE, start * VALUE_SIZE)
+    finally:
+        os.close(fd)
+    if len(leaves) != count * VALUE_SIZE:
+        raise ValueError("%s holds fewer than %d leaves" % (leafname, start + count))
+    return build_subtree(filename, base, leaves)
+
+
+def _create(filename: str):
+    """Create the output file empty, discarding any existing content"""
+    # The node count db.MmapDB recorded for any previous content is stale
+    if os.path.exists(filename + ".size"):
+        os.remove(filename + ".size")
+    with open(filename, "wb"):
+        pass
+
+
+def _windowed(fn, args: Iterable[tuple], executor, window: int):
+    """Yields fn(*a) for each of args, in order, with at most window calls pending"""
+    if executor is None:
+        for a in args:
+            yield fn(*a)
+        return
+
+    pending = deque()
+    for a in args:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, *a))
+    while pending:
+        yield pending.popleft().result()
+
+
+def _stitch(filename: str, blockheight: int, roots: Iterable[bytes], trailing: Iterable[bytes]) -> int:
+    """Add the nodes above the block roots, and the trailing leaves, to the file
+
+    Returns the size of the MMR.
+    """
+    stitched = []
+    spine = []
+
+    def merge(i: int, g: int) -> int:
+        # i is the index after a node of height g, merge while the next node is a parent
+        while index_height(i) > g:
+            right = spine.pop()
+            left = spine.pop()
+            v = hash_pospair64(i + 1, left, right)
+            spine.append(v)
+            stitched.append((i, v))
+            i += 1
+            g += 1
+        return i
+
+    # i is the mmr index of the first leaf of the next block
+    i = 0
+    for root in roots:
+        spine.append(root)
+        i = merge(i + (2 << blockheight) - 1, blockheight)
+
+    # the trailing leaves, which do not fill a block, are added by the parent
+    for f in trailing:
+        spine.append(f)
+        stitched.append((i, f))
+        i = merge(i + 1, 0)
+
+    fd = os.open(filename, os.O_WRONLY)
+    try:
+        for (j, v) in stitched:
+            os.pwrite(fd, v, j * VALUE_SIZE)
+        os.ftruncate(fd, i * VALUE_SIZE)
+    finally:
+        os.close(fd)
+
+    return i
+
+
+def build(filename: str, leaves: Iterable[bytes], blockheight: int = None, executor=None,
+          window: int = 16) -> int:
+    """Create the file of nodes for the MMR of leaves
+
+    Args:
+        filename (str): the output file, any existing content is discarded.
+        leaves (Iterable[bytes]): all of the leaf hash values, in order. They
+            are read a block at a time, so this may be a generator, eg
+            ingest.read_leaf_hashes.
+        blockheight (int): the height, h, of the subtrees hashed by each
+            worker. By default, if leaves has a length, it is divided into
+            about 64 blocks, otherwise DEFAULT_BLOCKHEIGHT is used.
+        executor: an optional concurrent.futures.Executor, typically a
+            ProcessPoolExecutor. If not provided, the blocks are hashed in turn
+            by the calling process.
+        window (int): the most blocks submitted to the executor at once. It
+            should be at least the number of workers.
+    Returns:
+        (int): the size of the MMR, which is where the next node would be added
+    """
+    if blockheight is None:
+        if hasattr(leaves, "__len__"):
+            blockheight = max(0, (len(leaves) // 64).bit_length() - 1)
+        else:
+            blockheight = DEFAULT_BLOCKHEIGHT
+    blockleaves = 1 << blockheight
+
+    _create(filename)
+
+    leaves = iter(leaves)
+    trailing = []
+
+    def blocks():
+        b = 0
+        while True:
+            block = list(islice(leaves, blockleaves))
+            if len(block) < blockleaves:
+                trailing.extend(block)
+                return
+            yield (filename, mmr_index(b << blockheight), b"".join(block))
+            b += 1
+
+    # trailing is filled once the blocks are exhausted, which is before
+    # _stitch reads it
+    roots = _windowed(build_subtree, blocks(), executor, window)
+    return _stitch(filename, blockheight, roots, trailing)
+
+
+def build_file(filename: str, leafname: str, blockheight: int = None, executor=None,
+               window: int = 16) -> int:
+    """Create the file of nodes for the MMR of the leaf hashes in leafname
+
+    As build, but leafname is a file of concatenated 32 byte leaf hashes, and
+    each worker reads its own block from it.
+    """
+    n = os.path.getsize(leafname) // VALUE_SIZE
+    if blockheight is None:
+        blockheight = max(0, (n // 64).bit_length() - 1)
+    blockleaves = 1 << blockheight
+    blocks = n >> blockheight
+
+    _create(filename)
+
+    args = ((filename, mmr_index(b << blockheight), leafname, b << blockheight, blockleaves)
+            for b in range(blocks))
+    roots = _windowed(build_subtree_file, args, executor, window)
+
+    with open(leafname, "rb") as f:
+        f.seek((blocks << blockheight) * VALUE_SIZE)
+        data = f.read((n - (blocks << blockheight)) * VALUE_SIZE)
+    trailing = [data[o:o + VALUE_SIZE] for o in range(0, len(data), VALUE_SIZE)]
+    return _stitch(filename, blockheight, roots, trailing)
@@ -0,0 +1,98 @@
+"""An opt-in, bounded cache of inclusion proof paths
+
+inclusion_proof_path is a pure function of (i, c), and proof requests tend to
+be for recent nodes against a small number of current MMR sizes. The cache
+exploits the prefix property of inclusion paths documented on
+algorithms.inclusion_proof_path: where c0 < c1, the path of i in MMR(c1) is
+the path of i in MMR(c0) extended by the path of its old root in MMR(c1). So a
+miss for (i, c1) is satisfied from a cached (i, c0) when one is present.
+"""
+import bisect
+from collections import OrderedDict, namedtuple
+from typing import List
+
+from algorithms import get_nodes
+from algorithms import inclusion_proof_path
+from algorithms import parent
+from algorithms import peaks
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "extended", "misses", "maxsize", "currsize"])
+
+
+class PathCache:
+    """A least recently used cache of inclusion proof paths, keyed by (i, c)"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.paths = OrderedDict()
+        # The sorted list of the cached c values for each i
+        self.sizes = {}
+
+        self.hits = 0
+        self.extended = 0
+        self.misses = 0
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.extended, self.misses, self.maxsize, len(self.paths))
+
+    def cache_clear(self):
+        self.paths.clear()
+        self.sizes.clear()
+        self.hits = self.extended = self.misses = 0
+
+    def inclusion_proof_path(self, i: int, c: int) -> List[int]:
+        """Returns the list of node indices proving inclusion of i in MMR(c)
+
+        See algorithms.inclusion_proof_path
+        """
+        path = self.paths.get((i, c))
+        if path is not None:
+            self.paths.move_to_end((i, c))
+            self.hits += 1
+            return list(path)
+
+        # Find the largest cached c0 < c and extend its path, if there is one
+        sizes = self.sizes.get(i, [])
+        k = bisect.bisect_left(sizes, c)
+        if k:
+            c0 = sizes[k - 1]
+            path = self.paths[(i, c0)]
+            self.paths.move_to_end((i, c0))
+            ioldroot = parent(path[-1]) if path else i
+            path = path + tuple(inclusion_proof_path(ioldroot, c))
+            self.extended += 1
+        else:
+            path = tuple(inclusion_proof_path(i, c))
+            self.misses += 1
+
+        self._put(i, c, path)
+        return list(path)
+
+    def consistency_proof_paths(self, ifrom: int, ito: int) -> List[List[int]]:
+        """Returns the proof paths showing consistency between MMR(ifrom) and MMR(ito)
+
+        See algorithms.consistency_proof_paths
+        """
+        return [self.inclusion_proof_path(ipeak, ito) for ipeak in peaks(ifrom)]
+
+    def inclusion_proof(self, db, i: int, ix: int) -> List[bytes]:
+        """Return a proof showing the node i is included in mmr(ix)"""
+        return get_nodes(db, self.inclusion_proof_path(i, ix))
+
+    def consistency_proof(self, db, ifrom: int, ito: int) -> List[List[bytes]]:
+        """Return a proof showing MMR(ito) is consistent with MMR(ifrom)"""
+        paths = self.consistency_proof_paths(ifrom, ito)
+        values = iter(get_nodes(db, [i for path in paths for i in path]))
+        return [[next(values) for _ in path] for path in paths]
+
+    def _put(self, i: int, c: int, path: tuple):
+        self.paths[(i, c)] = path
+        bisect.insort(self.sizes.setdefault(i, []), c)
+
+        while len(self.paths) > self.maxsize:
+            ((i, c), _) = self.paths.popitem(last=False)
+            sizes = self.sizes[i]
+            sizes.remove(c)
+            if not sizes:
+                del self.sizes[i]
@@ -0,0 +1,124 @@
+"""A compact binary encoding for proofs and accumulators
+
+Every encoding is a one byte type tag, the unsigned LEB128 encoded counts
+needed to frame the nodes, and then the 32 byte nodes packed contiguously.
+
+    inclusion proof         0x01 count nodes
+    consistency proof       0x02 npaths count[npaths] nodes
+    flat consistency proof  0x03 count nodes
+    accumulator             0x04 count nodes
+
+The nested consistency proof is the form produced by
+algorithms.consistency_proof, the flat form is that produced by
+algorithms_consistency_as_flat_array.consistency_proof_flat.
+
+Decoding does not copy the nodes. They are returned as memoryview slices of the
+encoded data, which the verifiers accept in place of bytes.
+"""
+from typing import List, Tuple
+
+
+VALUE_SIZE = 32
+
+INCLUSION_PROOF = 0x01
+CONSISTENCY_PROOF = 0x02
+CONSISTENCY_PROOF_FLAT = 0x03
+ACCUMULATOR = 0x04
+
+
+def encode_uvarint(v: int) -> bytes:
+    """Returns the unsigned LEB128 encoding of v"""
+    out = bytearray()
+    while True:
+        b = v & 0x7f
+        v >>= 7
+        if v:
+            out.append(b | 0x80)
+            continue
+        out.append(b)
+        return bytes(out)
+
+
+def decode_uvarint(data, offset: int) -> Tuple[int, int]:
+    """Returns the unsigned LEB128 value at offset, and the offset after it"""
+    v = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("truncated varint")
+        b = data[offset]
+        offset += 1
+        v |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return v, offset
+        shift += 7
+
+
+def _encode(tag: int, counts: List[int], nodes: List[bytes]) -> bytes:
+    for v in nodes:
+        if len(v) != VALUE_SIZE:
+            raise ValueError("nodes must be %d bytes" % VALUE_SIZE)
+    return b"".join([bytes([tag])] + [encode_uvarint(c) for c in counts] + nodes)
+
+
+def _decode_nodes(data, offset: int, count: int) -> List[memoryview]:
+    view = memoryview(data)
+    if len(view) != offset + count * VALUE_SIZE:
+        raise ValueError("expected %d nodes, found %d bytes" % (count, len(view) - offset))
+    return [view[o:o + VALUE_SIZE] for o in range(offset, len(view), VALUE_SIZE)]
+
+
+def _decode_list(tag: int, data) -> List[memoryview]:
+    if not len(data) or data[0] != tag:
+        raise ValueError("expected type 0x%02x" % tag)
+    count, offset = decode_uvarint(data, 1)
+    return _decode_nodes(data, offset, count)
+
+
+def encode_inclusion_proof(proof: List[bytes]) -> bytes:
+    return _encode(INCLUSION_PROOF, [len(proof)], proof)
+
+
+def decode_inclusion_proof(data) -> List[memoryview]:
+    return _decode_list(INCLUSION_PROOF, data)
+
+
+def encode_consistency_proof(proofs: List[List[bytes]]) -> bytes:
+    return _encode(
+        CONSISTENCY_PROOF,
+        [len(proofs)] + [len(path) for path in proofs],
+        [v for path in proofs for v in path])
+
+
+def decode_consistency_proof(data) -> List[List[memoryview]]:
+    if not len(data) or data[0] != CONSISTENCY_PROOF:
+        raise ValueError("expected type 0x%02x" % CONSISTENCY_PROOF)
+    npaths, offset = decode_uvarint(data, 1)
+    counts = []
+    for _ in range(npaths):
+        count, offset = decode_uvarint(data, offset)
+        counts.append(count)
+
+    nodes = _decode_nodes(data, offset, sum(counts))
+    proofs = []
+    start = 0
+    for count in counts:
+        proofs.append(nodes[start:start + count])
+        start += count
+    return proofs
+
+
+def encode_consistency_proof_flat(path: List[bytes]) -> bytes:
+    return _encode(CONSISTENCY_PROOF_FLAT, [len(path)], path)
+
+
+def decode_consistency_proof_flat(data) -> List[memoryview]:
+    return _decode_list(CONSISTENCY_PROOF_FLAT, data)
+
+
+def encode_accumulator(accumulator: List[bytes]) -> bytes:
+    return _encode(ACCUMULATOR, [len(accumulator)], accumulator)
+
+
+def decode_accumulator(data) -> List[memoryview]:
+    return _decode_list(ACCUMULATOR, data)
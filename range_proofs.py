@@ -0,0 +1,163 @@
+"""Multi-proofs of inclusion, for many nodes of MMR(c) at once
+
+Proving a contiguous range of leaves with one inclusion proof each repeats
+most of the siblings: neighbouring leaves share all but the lowest parts of
+their paths, and a sibling which is itself proven, or is an ancestor of a
+proven node, never needs to be supplied. A multi-proof holds only the
+frontier: the siblings, on the paths of the proven nodes, which can not be
+computed from them.
+
+The paths are walked bottom up, a level at a time, in the same way as
+included_root. Each parent is computed once, from its pair of children, and
+each walk ends at a peak of MMR(c). The frontier is listed in the order this
+walk needs it, so the verifier consumes the proof in a single pass. Both the
+proof size and the verification work scale with the frontier and the shared
+ancestors, not with the sum of the individual paths.
+"""
+from typing import Dict, List
+
+from algorithms import get_nodes
+from algorithms import hash_pospair64
+from algorithms import index_height
+from algorithms import mmr_index
+from algorithms import peaks
+
+
+def _walk(indices: List[int], c: int):
+    """Walks the paths from indices to the peaks of MMR(c), bottom up
+
+    Yields (i, sibling, parent, known) for each pair of children, once per
+    parent, in the order needed to compute them. i is the first child reached,
+    and known is False when sibling is a frontier node. Yields
+    (i, None, None, True) for each peak reached.
+    """
+    if not indices:
+        raise ValueError("at least one index is required")
+    peakset = set(peaks(c))
+
+    levels = {}
+    for i in indices:
+        if i < 0 or i > c:
+            raise ValueError("%d is not in MMR(%d)" % (i, c))
+        levels.setdefault(index_height(i), set()).add(i)
+
+    g = 0
+    while levels:
+        level = levels.pop(g, ())
+        paired = set()
+        for i in sorted(level):
+            if i in peakset:
+                yield (i, None, None, True)
+                continue
+
+            if index_height(i + 1) > g:
+                # i is a right child
+                (sibling, parent) = (i - (2 << g) + 1, i + 1)
+            else:
+                (sibling, parent) = (i + (2 << g) - 1, i + (2 << g))
+            if parent in paired:
+                continue
+            paired.add(parent)
+            levels.setdefault(g + 1, set()).add(parent)
+            yield (i, sibling, parent, sibling in level)
+        g += 1
+
+
+def multi_proof_path(indices: List[int], c: int) -> List[int]:
+    """Returns the frontier of sibling indices proving all of indices in MMR(c)
+
+    The frontier is in the order in which verification consumes it.
+    """
+    return [sibling for (_, sibling, _, known) in _walk(indices, c) if not known]
+
+
+def multi_proof(db, indices: List[int], c: int) -> List[bytes]:
+    """Returns a multi-proof showing all of indices are included in MMR(c)"""
+    return get_nodes(db, multi_proof_path(indices, c))
+
+
+def range_indices(efrom: int, eto: int) -> List[int]:
+    """Returns the mmr indices of the leaves [efrom, eto)"""
+    return [mmr_index(e) for e in range(efrom, eto)]
+
+
+def range_proof(db, efrom: int, eto: int, c: int) -> List[bytes]:
+    """Returns a multi-proof showing the leaves [efrom, eto) are included in MMR(c)"""
+    return multi_proof(db, range_indices(efrom, eto), c)
+
+
+def multi_included_roots(
+    indices: List[int], values: List[bytes], proof: List[bytes], c: int
+) -> Dict[int, bytes]:
+    """Apply the multi-proof to values to produce the implied peak roots
+
+    Args:
+        indices (List[int]): the mmr indices being proven.
+        values (List[bytes]): the values at indices.
+        proof (List[bytes]): the frontier, as produced by multi_proof.
+        c (int): the mmr index of the MMR the proof is against.
+
+    Returns:
+        the root produced for each peak reached, keyed by the peak index
+
+    Raises:
+        ValueError: if the proof is the wrong length, or the values given for
+            a node and its descendants are inconsistent.
+    """
+    nodes = dict(zip(indices, values))
+    if len(nodes) != len(values) or len(values) != len(indices):
+        raise ValueError("indices must be distinct and have one value each")
+
+    roots = {}
+    frontier = iter(proof)
+    for (i, sibling, parent, known) in _walk(indices, c):
+        if sibling is None:
+            roots[i] = nodes[i]
+            continue
+
+        if known:
+            vsibling = nodes[sibling]
+        else:
+            vsibling = next(frontier, None)
+            if vsibling is None:
+                raise ValueError("the proof is too short")
+
+        if parent == i + 1:
+            v = hash_pospair64(parent + 1, vsibling, nodes[i])
+        else:
+            v = hash_pospair64(parent + 1, nodes[i], vsibling)
+
+        if nodes.setdefault(parent, v) != v:
+            raise ValueError("the value proven for %d is inconsistent with its children" % parent)
+
+    if next(frontier, None) is not None:
+        raise ValueError("the proof is too long")
+    return roots
+
+
+def verify_multi_inclusion(
+    indices: List[int], values: List[bytes], proof: List[bytes], c: int, accumulator: List[bytes]
+) -> bool:
+    """Verify a multi-proof against the accumulator of MMR(c)
+
+    accumulator is the list of peak values, in the order of peaks(c).
+    """
+    peakindices = peaks(c)
+    if len(accumulator) != len(peakindices):
+        return False
+
+    try:
+        roots = multi_included_roots(indices, values, proof, c)
+    except ValueError:
+        return False
+
+    positions = dict((p, k) for (k, p) in enumerate(peakindices))
+    return all(accumulator[positions[p]] == root for (p, root) in roots.items())
+
+
+def verify_range_inclusion(
+    efrom: int, values: List[bytes], proof: List[bytes], c: int, accumulator: List[bytes]
+) -> bool:
+    """Verify a multi-proof for the leaves [efrom, efrom + len(values)) against MMR(c)"""
+    return verify_multi_inclusion(
+        range_indices(efrom, efrom + len(values)), values, proof, c, accumulator)
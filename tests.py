@@ -1,6 +1,13 @@
 """
 See the notational conventions in the accompanying draft text for definition of short hand variables.
 """
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import os
+import random
+import tempfile
 import unittest
 
 from typing import List
@@ -14,21 +21,58 @@ from algorithms import verify_consistent_roots
 from algorithms_consistency_as_flat_array import verify_inclusion_path
 from algorithms import mmr_index
 from algorithms import index_height
+from algorithms import index_height_jump_left
 from algorithms import accumulator_index
 from algorithms import peaks
 from algorithms import peak_depths
 from algorithms import leaf_count
+from algorithms import complete_leaf_count, mmr_index_peak_sum
 from algorithms import parent
 from algorithms import accumulator_root
 from algorithms import next_proof
+from algorithms import leaf_witness_update_due
 from algorithms import complete_mmr
+from algorithms import add_leaf_hash, add_leaf_hashes
+from algorithms import inclusion_proof, consistency_proof
+from algorithms import get_nodes
 
 from tableprint import complete_mmr_sizes, complete_mmr_indices
 from tableprint import peaks_table
 from tableprint import index_values_table
 from tableprint import inclusion_paths_table
 
-from db import KatDB, FlatDB
+from db import KatDB, FlatDB, MmapDB, SqliteDB
+from journal import JournaledDB
+from multilog import LogPool, SharedNodeCache
+from range_proofs import multi_proof, multi_proof_path, range_proof, verify_multi_inclusion, verify_range_inclusion
+from leaves import add_leaf, consistency_proof_by_leaves, inclusion_proof_by_leaf, size_leaf_count
+from batch_verify import verify_inclusions_batch
+from path_cache import PathCache
+from accumulator import Accumulator
+from ingest import ingest, read_leaf_hashes, read_records, skip_ingested
+from algorithms import hash_pospair64
+from hash_backend import hash_backend
+import parallel_build
+from algorithms_consistency_deduplicated import consistency_proof_nodes
+from algorithms_consistency_deduplicated import consistency_proof_deduplicated
+from algorithms_consistency_deduplicated import expand_consistency_proof
+from algorithms_consistency_fast import verify_consistent_roots_fast
+from massifs import HEADER, MassifDB, massif_index, massif_range
+from node_cache import CachingDB
+from async_algorithms import AsyncFlatDB
+from async_algorithms import async_add_leaf_hash
+from async_algorithms import async_inclusion_proof, async_consistency_proof
+import proof_encoding
+from witness_updates import WitnessMaintainer, witness_update_due
+import algorithms
+from instrumentation import instrumented
+from db import hash_num64
+
+try:
+    import numpy as np
+    import algorithms_vectorized
+except ImportError:
+    np = None
 
 
 class TestIndexOperations(unittest.TestCase):
@@ -49,6 +93,35 @@ class TestIndexOperations(unittest.TestCase):
         for i in range(39):
             self.assertEqual(heights[i], expect[i])
 
+    def test_index_height_equivalence(self):
+        """index_height matches the jump left formulation for every index up to 2^20"""
+        indices = range((1 << 20) + 1)
+        self.assertEqual(
+            [index_height(i) for i in indices],
+            [index_height_jump_left(i) for i in indices])
+
+    def test_index_height_equivalence_large(self):
+        """index_height matches the jump left formulation for large indices"""
+        rng = random.Random(0)
+        for bits in range(20, 64):
+            for i in [(1 << bits) - 2, (1 << bits) - 1, 1 << bits] + [
+                    rng.randrange(1 << bits) for _ in range(200)]:
+                self.assertEqual(index_height(i), index_height_jump_left(i), i)
+
+    @unittest.skipUnless(np, "numpy is not available")
+    def test_index_heights_vectorized(self):
+        """The vectorized index_heights matches index_height for every index up to 2^20"""
+        indices = np.arange((1 << 20) + 1, dtype=np.uint64)
+        self.assertEqual(
+            algorithms_vectorized.index_heights(indices).tolist(),
+            [index_height(i) for i in range((1 << 20) + 1)])
+
+        rng = random.Random(0)
+        large = [rng.randrange(1 << 62) for _ in range(10000)]
+        self.assertEqual(
+            algorithms_vectorized.index_heights(large).tolist(),
+            [index_height(i) for i in large])
+
     def test_index_leaf_counts(self):
         """The leaf counts calculated for each mmr index are correct"""
 
@@ -201,6 +274,1184 @@ class TestAddLeafHash(unittest.TestCase):
                 self.assertEqual(db.store[p].hex(), expect_values[j])
 
 
+    def test_add_leaf_hashes(self):
+        """Adding the 21 canonical leaf values in one batch produces the canonical db"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+        db = FlatDB()
+        i = add_leaf_hashes(db, [hash_num64(mmr_index(e)) for e in range(21)])
+
+        self.assertEqual(i, 39)
+        for i in range(39):
+            self.assertEqual(db.store[i], katdb.store[i])
+
+    def test_add_leaf_hashes_batches(self):
+        """Batches of any size produce the same nodes as repeated add_leaf_hash calls"""
+        leaves = [hash_num64(e) for e in range(300)]
+
+        expect = FlatDB()
+        for f in leaves:
+            add_leaf_hash(expect, f)
+
+        for batchsize in (1, 2, 3, 7, 16, 33, 300):
+            db = FlatDB()
+            for start in range(0, len(leaves), batchsize):
+                i = add_leaf_hashes(db, leaves[start:start + batchsize])
+                self.assertEqual(i, len(db.store))
+            self.assertEqual(db.store, expect.store)
+
+
+class TestGetMany(unittest.TestCase):
+
+    class RecordingDB(FlatDB):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        def get_many(self, indices):
+            self.calls.append(list(indices))
+            return super().get_many(indices)
+
+    class GetOnlyDB(FlatDB):
+        get_many = None
+
+    def test_get_nodes(self):
+        """Values are returned in the requested order, with or without get_many"""
+        db = self.RecordingDB()
+        db.init_size(39)
+        getonly = self.GetOnlyDB()
+        getonly.init_size(39)
+
+        indices = [30, 2, 2, 14, 0, 38, 14]
+        expect = [db.store[i] for i in indices]
+        self.assertEqual(get_nodes(db, indices), expect)
+        self.assertEqual(get_nodes(getonly, indices), expect)
+        self.assertEqual(db.calls, [[0, 2, 14, 30, 38]])
+
+    def test_proofs(self):
+        """Each proof is read with one get_many call of distinct ascending indices"""
+        db = self.RecordingDB()
+        db.init_size(39)
+        getonly = self.GetOnlyDB()
+        getonly.init_size(39)
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        for (i, ito) in enumerate(complete_mmr_indices):
+            for ii in range(ito + 1):
+                db.calls = []
+                proof = inclusion_proof(db, ii, ito)
+                self.assertEqual(proof, inclusion_proof(getonly, ii, ito))
+                self.assertEqual(proof, inclusion_proof(katdb, ii, ito))
+                self.assertEqual(db.calls, [sorted(inclusion_proof_path(ii, ito))])
+
+            for ifrom in complete_mmr_indices[:i]:
+                db.calls = []
+                proof = consistency_proof(db, ifrom, ito)
+                self.assertEqual(proof, consistency_proof(getonly, ifrom, ito))
+                self.assertEqual(proof, consistency_proof(katdb, ifrom, ito))
+                self.assertEqual(len(db.calls), 1)
+                self.assertEqual(db.calls[0], sorted(set(db.calls[0])))
+
+
+class TestSqliteDB(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "mmr.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_add(self):
+        """The sqlite backed db matches the canonical known answer db"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        with SqliteDB(self.filename) as db:
+            for e in range(21):
+                with db.transaction():
+                    add_leaf_hash(db, hash_num64(mmr_index(e)))
+
+            self.assertEqual(len(db), 39)
+            for i in range(39):
+                self.assertEqual(db.get(i), katdb.store[i])
+            self.assertEqual(db.get_many(range(38, -1, -1)), [katdb.store[i] for i in range(38, -1, -1)])
+            self.assertEqual(inclusion_proof(db, 7, 38), inclusion_proof(katdb, 7, 38))
+            self.assertRaises(IndexError, db.get, 39)
+            self.assertRaises(IndexError, db.get_many, [1, 39])
+
+    def test_reopen(self):
+        """Only committed leaves survive re-opening, and appends resume after them"""
+        expect = FlatDB()
+        expect.init_size(39)
+
+        db = SqliteDB(self.filename)
+        with db.transaction():
+            add_leaf_hashes(db, [hash_num64(mmr_index(e)) for e in range(11)])
+        add_leaf_hash(db, hash_num64(mmr_index(11)))
+        db.conn.close()  # without committing the last leaf
+
+        with SqliteDB(self.filename) as db:
+            self.assertEqual(len(db), 19)
+            with db.transaction():
+                for e in range(11, 21):
+                    add_leaf_hash(db, hash_num64(mmr_index(e)))
+
+            for i in range(39):
+                self.assertEqual(db.get(i), expect.store[i])
+
+    def test_rollback(self):
+        """A failed transaction leaves none of its appends"""
+        with SqliteDB(self.filename) as db:
+            with db.transaction():
+                add_leaf_hash(db, hash_num64(0))
+            with self.assertRaises(RuntimeError):
+                with db.transaction():
+                    add_leaf_hash(db, hash_num64(1))
+                    raise RuntimeError("failed")
+            self.assertEqual(len(db), 1)
+            self.assertRaises(IndexError, db.get, 1)
+
+
+class TestJournaledDB(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "mmr.bin")
+        self.expect = FlatDB()
+        self.expect.init_size(39)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def crash(self, db):
+        """Abandon db without committing"""
+        os.close(db.fd)
+        os.close(db.journalfd)
+
+    def test_add(self):
+        """The journaled db matches the canonical db, and resumes after re-opening"""
+        with JournaledDB(self.filename, group_commit=4) as db:
+            for e in range(11):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+            self.assertEqual(db.written, 15)
+
+        with JournaledDB(self.filename) as db:
+            self.assertEqual(len(db), 19)
+            for e in range(11, 21):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+            self.assertEqual([db.get(i) for i in range(39)], self.expect.store)
+
+        self.assertEqual(os.path.getsize(self.filename), 39 * 32)
+        self.assertEqual(os.path.getsize(self.filename + ".journal"), 0)
+
+    def test_crash(self):
+        """Only the leaves of committed groups survive a crash"""
+        db = JournaledDB(self.filename, group_commit=4)
+        for e in range(10):
+            add_leaf_hash(db, hash_num64(mmr_index(e)))
+        self.crash(db)
+
+        with JournaledDB(self.filename) as db:
+            self.assertEqual(len(db), mmr_index(8))
+            self.assertEqual(db.get_many(range(15)), self.expect.store[:15])
+
+    def test_replay(self):
+        """Torn data file writes are repaired from the journal"""
+        db = JournaledDB(self.filename, group_commit=2)
+        for e in range(8):
+            add_leaf_hash(db, hash_num64(mmr_index(e)))
+        self.crash(db)
+
+        # a leaf without its parents, and a torn journal record
+        with open(self.filename, "r+b") as f:
+            f.truncate(12 * 32 + 5)
+            f.seek(3 * 32)
+            f.write(bytes(32))
+        with open(self.filename + ".journal", "ab") as f:
+            f.write(b"\x00" * 7 + b"\x0f" + b"\x00\x00\x00\x03" + bytes(40))
+
+        with JournaledDB(self.filename) as db:
+            self.assertEqual(len(db), 15)
+            self.assertEqual([db.get(i) for i in range(15)], self.expect.store[:15])
+
+    def test_truncate(self):
+        """An incomplete leaf in the data file is truncated on open"""
+        with JournaledDB(self.filename) as db:
+            for e in range(3):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+        with open(self.filename, "ab") as f:
+            f.write(hash_num64(4))
+
+        with JournaledDB(self.filename) as db:
+            self.assertEqual(len(db), 4)
+            add_leaf_hash(db, hash_num64(4))
+            self.assertEqual(len(db), 7)
+            self.assertEqual([db.get(i) for i in range(7)], self.expect.store[:7])
+
+
+class TestLogPool(unittest.TestCase):
+
+    def leaves(self, log_id, count):
+        return [hashlib.sha256(b"%d/%d" % (log_id, e)).digest() for e in range(count)]
+
+    def expect(self, log_id, count):
+        db = FlatDB()
+        add_leaf_hashes(db, self.leaves(log_id, count))
+        return db
+
+    def test_logs(self):
+        """Interleaved logs match separately built ones, and proofs are routed by log id"""
+        with LogPool(shards=3) as pool:
+            for e in range(21):
+                for log_id in range(7):
+                    pool.add_leaf_hash(log_id, self.leaves(log_id, 21)[e])
+
+            for log_id in range(7):
+                expect = self.expect(log_id, 21)
+                self.assertEqual(len(pool.db(log_id)), 39)
+                self.assertEqual(pool.db(log_id).get_many(range(39)), expect.store)
+                self.assertEqual(pool.inclusion_proof(log_id, 7, 38), inclusion_proof(expect, 7, 38))
+                self.assertEqual(
+                    pool.consistency_proof(log_id, 10, 38), consistency_proof(expect, 10, 38))
+
+    def test_append_many(self):
+        """Concurrent appends to many logs, in file backed shards"""
+        items = [(log_id, f) for e in range(50) for log_id in range(20)
+                 for f in self.leaves(log_id, 50)[e:e + 1]]
+
+        with tempfile.TemporaryDirectory() as tmpdir, LogPool(tmpdir, shards=4) as pool, \
+                concurrent.futures.ThreadPoolExecutor(4) as executor:
+            sizes = pool.append_many(items[:500], executor)
+            sizes.update(pool.append_many(items[500:], executor))
+            self.assertEqual(sizes, dict((log_id, mmr_index(50)) for log_id in range(20)))
+            for log_id in range(20):
+                self.assertEqual(
+                    pool.db(log_id).get_many(range(mmr_index(50))), self.expect(log_id, 50).store)
+            self.assertEqual(len(os.listdir(tmpdir)), 8)
+
+    def test_reopen(self):
+        """A file backed pool re-opens each log at its last complete leaf"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with LogPool(tmpdir, shards=3) as pool:
+                for log_id in range(7):
+                    pool.add_leaf_hashes(log_id, self.leaves(log_id, 10))
+                for log_id in range(7):
+                    pool.add_leaf_hash(log_id, self.leaves(log_id, 11)[10])
+                # log 0 is left part way through leaf 11, which has a parent
+                pool.db(0).append(self.leaves(0, 12)[11])
+
+            # and one shard is left with a torn run record
+            with open(os.path.join(tmpdir, "shard-0001.bin.runs"), "ab") as f:
+                f.write(b"\x00" * 9)
+
+            self.assertRaises(ValueError, LogPool, tmpdir, shards=4)
+            with LogPool(tmpdir, shards=3) as pool:
+                for log_id in range(7):
+                    self.assertEqual(len(pool.db(log_id)), mmr_index(11))
+                    pool.add_leaf_hashes(log_id, self.leaves(log_id, 21)[11:])
+
+            with LogPool(tmpdir, shards=3) as pool:
+                for log_id in range(7):
+                    self.assertEqual(pool.db(log_id).get_many(range(39)), self.expect(log_id, 21).store)
+                self.assertRaises(ValueError, pool.db, object())
+                pool.add_leaf_hash(("tenant", b"log"), self.leaves(0, 1)[0])
+            with LogPool(tmpdir, shards=3) as pool:
+                self.assertEqual(len(pool.db(("tenant", b"log"))), 1)
+
+    def test_budget(self):
+        """The node cache is shared by all logs, and bounded by one budget"""
+        with LogPool(shards=2, budget=(32 + SharedNodeCache.ENTRY_OVERHEAD) * 100) as pool:
+            for log_id in range(10):
+                pool.add_leaf_hashes(log_id, self.leaves(log_id, 21))
+            for log_id in range(10):
+                pool.inclusion_proof(log_id, 0, 38)
+                pool.inclusion_proof(log_id, 0, 38)
+            self.assertEqual(pool.cache.hits, 10 * len(inclusion_proof_path(0, 38)))
+
+            for log_id in range(10):
+                pool.db(log_id).get_many(range(39))
+            self.assertEqual(len(pool.cache.lru), 100)
+            self.assertEqual(pool.cache.bytes, (32 + SharedNodeCache.ENTRY_OVERHEAD) * 100)
+
+
+class TestMmapDB(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "mmr.bin")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_add(self):
+        """The mmap backed db matches the canonical known answer db"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        with MmapDB(self.filename) as db:
+            for e in range(21):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+
+            self.assertEqual(len(db), 39)
+            for i in range(39):
+                self.assertEqual(db.get(i), katdb.store[i])
+
+        self.assertEqual(os.path.getsize(self.filename), 39 * MmapDB.VALUE_SIZE)
+
+    def test_reopen(self):
+        """Appends resume at the correct mmr size after re-opening"""
+        expect = FlatDB()
+        expect.init_size(39)
+
+        with MmapDB(self.filename) as db:
+            for e in range(11):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+
+        with MmapDB(self.filename) as db:
+            self.assertEqual(len(db), 19)
+            for e in range(11, 21):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+
+            for i in range(39):
+                self.assertEqual(db.get(i), expect.store[i])
+
+    def test_reopen_unclean(self):
+        """After an unclean shutdown, appends resume from the last flush"""
+        expect = FlatDB()
+        expect.init_size(39)
+
+        db = MmapDB(self.filename)
+        add_leaf_hashes(db, [hash_num64(mmr_index(e)) for e in range(5)])
+        db.flush()
+        add_leaf_hash(db, hash_num64(mmr_index(5)))
+        del db  # without close, the file still holds the padded capacity
+
+        self.assertEqual(os.path.getsize(self.filename), MmapDB.MIN_NODES * MmapDB.VALUE_SIZE)
+        with MmapDB(self.filename) as db:
+            self.assertEqual(len(db), 8)
+            for e in range(5, 21):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+            self.assertEqual([bytes(db.get(i)) for i in range(39)], expect.store)
+
+    def test_reopen_short(self):
+        """A file shorter than its recorded node count is rejected"""
+        with MmapDB(self.filename) as db:
+            add_leaf_hashes(db, [hash_num64(e) for e in range(3)])
+        with open(self.filename, "r+b") as f:
+            f.truncate(3 * MmapDB.VALUE_SIZE)
+        self.assertRaises(ValueError, MmapDB, self.filename)
+
+    def test_reopen_rebuilt(self):
+        """A file rebuilt by parallel_build is not limited by the previous node count"""
+        leaves = [hash_num64(e) for e in range(100)]
+        with MmapDB(self.filename) as db:
+            add_leaf_hashes(db, leaves[:50])
+
+        parallel_build.build(self.filename, leaves)
+        with MmapDB(self.filename) as db:
+            self.assertEqual(len(db), mmr_index(100))
+
+    def test_reopen_replaced(self):
+        """A node count recorded for a file which has since been replaced is refused"""
+        with MmapDB(self.filename) as db:
+            add_leaf_hashes(db, [hash_num64(e) for e in range(50)])
+
+        replacement = FlatDB()
+        add_leaf_hashes(replacement, [hash_num64(e) for e in range(100)])
+        with open(self.filename + ".tmp", "wb") as f:
+            f.write(b"".join(replacement.store))
+        os.replace(self.filename + ".tmp", self.filename)
+        self.assertRaises(ValueError, MmapDB, self.filename)
+
+    def test_reopen_incomplete(self):
+        """A file which does not hold a complete mmr is rejected"""
+        with open(self.filename, "wb") as f:
+            f.write(hash_num64(0) * 2)
+        self.assertRaises(ValueError, MmapDB, self.filename)
+
+        with open(self.filename, "wb") as f:
+            f.write(hash_num64(0)[:31])
+        self.assertRaises(ValueError, MmapDB, self.filename)
+
+    def test_growth(self):
+        """Appending beyond the mapped capacity preserves previously read nodes"""
+        MmapDB.MIN_NODES, saved = 8, MmapDB.MIN_NODES
+        try:
+            with MmapDB(self.filename) as db:
+                first = db.get(add_leaf_hash(db, hash_num64(0)) - 1)
+                add_leaf_hashes(db, [hash_num64(e) for e in range(1, 100)])
+                self.assertEqual(first, hash_num64(0))
+
+                expect = FlatDB()
+                add_leaf_hashes(expect, [hash_num64(e) for e in range(100)])
+                self.assertEqual(len(db), len(expect))
+                for i in range(len(expect)):
+                    self.assertEqual(db.get(i), expect.store[i])
+        finally:
+            MmapDB.MIN_NODES = saved
+
+    def test_proofs(self):
+        """Inclusion and consistency proofs read from the mmap db verify"""
+        with MmapDB(self.filename) as db:
+            for e in range(21):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+
+            for (i, ito) in enumerate(complete_mmr_indices):
+                accumulatorto = [db.get(ii) for ii in peaks(ito)]
+
+                for ifrom in complete_mmr_indices[:i]:
+                    proofs = consistency_proof(db, ifrom, ito)
+                    accumulatorfrom = [db.get(ii) for ii in peaks(ifrom)]
+                    self.assertTrue(
+                        verify_consistent_roots(ifrom, accumulatorfrom, accumulatorto, proofs))
+
+                for ii in range(ito + 1):
+                    root = included_root(ii, db.get(ii), inclusion_proof(db, ii, ito))
+                    self.assertIn(root, accumulatorto)
+
+
+class TestLeafAddressed(unittest.TestCase):
+
+    def test_mmr_index(self):
+        """The closed form mmr_index matches the leaf positions in the canonical MMR"""
+        expect = [0, 1, 3, 4, 7, 8, 10, 11, 15, 16, 18, 19, 22, 23, 25, 26, 31, 32, 34, 35, 38]
+        self.assertEqual([mmr_index(e) for e in range(21)], expect)
+        for (e, i) in enumerate(expect):
+            self.assertEqual(index_height(i), 0)
+            self.assertEqual(size_leaf_count(i), e)
+        self.assertRaises(ValueError, size_leaf_count, 2)
+        self.assertRaises(ValueError, size_leaf_count, 5)
+
+        rng = random.Random(0)
+        for e in list(range(1 << 16)) + [rng.randrange(1 << 64) for _ in range(10000)]:
+            self.assertEqual(mmr_index(e), mmr_index_peak_sum(e))
+
+    def test_complete_leaf_count(self):
+        """complete_leaf_count finds the largest complete MMR within n nodes"""
+        e = 0
+        for n in range(mmr_index(1000)):
+            if mmr_index(e + 1) <= n:
+                e += 1
+            self.assertEqual(complete_leaf_count(n), e)
+
+        rng = random.Random(0)
+        for _ in range(10000):
+            n = rng.randrange(1 << 64)
+            e = complete_leaf_count(n)
+            self.assertLessEqual(mmr_index(e), n)
+            self.assertGreater(mmr_index(e + 1), n)
+
+    @unittest.skipUnless(np, "numpy is not available")
+    def test_mmr_indices(self):
+        """The vectorized conversion matches mmr_index"""
+        rng = random.Random(0)
+        leaves = list(range(1000)) + [rng.randrange(1 << 62) for _ in range(1000)]
+        self.assertEqual(
+            algorithms_vectorized.mmr_indices(leaves).tolist(), [mmr_index(e) for e in leaves])
+
+    def test_proofs(self):
+        """The leaf addressed calls match the mmr index addressed ones"""
+        db = FlatDB()
+        self.assertEqual([add_leaf(db, hash_num64(mmr_index(e))) for e in range(21)], list(range(21)))
+        self.assertEqual(len(db), 39)
+
+        for n in range(1, 22):
+            for e in range(n):
+                self.assertEqual(
+                    inclusion_proof_by_leaf(db, e, n),
+                    inclusion_proof(db, mmr_index(e), complete_mmr(mmr_index(n - 1))))
+            self.assertEqual(
+                consistency_proof_by_leaves(db, n, 21),
+                consistency_proof(db, complete_mmr(mmr_index(n - 1)), 38))
+        self.assertRaises(ValueError, inclusion_proof_by_leaf, db, 5, 5)
+        self.assertRaises(ValueError, consistency_proof_by_leaves, db, 6, 5)
+
+
+class TestInclusionProofPaths(unittest.TestCase):
+
+    @unittest.skipUnless(np, "numpy is not available")
+    def test_inclusion_proof_paths(self):
+        """The vectorized paths match inclusion_proof_path for every node in every complete MMR"""
+        for c in complete_mmr_indices:
+            paths, offsets = algorithms_vectorized.inclusion_proof_paths(
+                np.arange(c + 1), c)
+            self.assertEqual(len(offsets), c + 2)
+            for i in range(c + 1):
+                self.assertEqual(
+                    paths[offsets[i]:offsets[i + 1]].tolist(), inclusion_proof_path(i, c))
+
+    @unittest.skipUnless(np, "numpy is not available")
+    def test_inclusion_proof_paths_large(self):
+        """The vectorized paths match inclusion_proof_path for a sample of a large MMR"""
+        c = complete_mmr(1 << 40)
+        rng = random.Random(0)
+        indices = [rng.randrange(c + 1) for _ in range(2000)] + [0, c]
+        paths, offsets = algorithms_vectorized.inclusion_proof_paths(indices, c)
+        for (j, i) in enumerate(indices):
+            self.assertEqual(
+                paths[offsets[j]:offsets[j + 1]].tolist(), inclusion_proof_path(i, c))
+
+
+class TestAccumulator(unittest.TestCase):
+
+    def test_accumulator(self):
+        """The accumulator matches the peaks read from the db at every size"""
+        db = FlatDB()
+        acc = Accumulator()
+        self.assertEqual(acc.peaks, [])
+
+        for e in range(300):
+            f = hash_num64(e)
+            i = add_leaf_hash(db, f)
+            self.assertEqual(acc.add_leaf_hash(f), i)
+            self.assertEqual(acc.peaks, [db.get(p) for p in peaks(i - 1)])
+
+    def test_accumulator_db(self):
+        """Nodes appended by the accumulator match those added by add_leaf_hash"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        db = FlatDB()
+        acc = Accumulator()
+        for e in range(21):
+            acc.add_leaf_hash(hash_num64(mmr_index(e)), db)
+
+        self.assertEqual(acc.size, 39)
+        for i in range(39):
+            self.assertEqual(db.store[i], katdb.store[i])
+
+    def test_persist(self):
+        """A persisted accumulator is restored with the same size and peaks"""
+        db = FlatDB()
+        db.init_size(39)
+
+        for ix in complete_mmr_indices:
+            acc = Accumulator.from_db(db, ix + 1)
+            restored = Accumulator.from_bytes(acc.to_bytes())
+            self.assertEqual(restored.size, ix + 1)
+            self.assertEqual(restored.peaks, [db.get(p) for p in peaks(ix)])
+
+        self.assertRaises(ValueError, Accumulator, 19, [hash_num64(0)])
+        self.assertRaises(ValueError, Accumulator.from_bytes, acc.to_bytes()[:-1])
+
+
+class TestIngest(unittest.TestCase):
+
+    def test_ingest(self):
+        """Ingesting a generator in small batches produces the canonical db"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        db = FlatDB()
+        reports = []
+        p = ingest(db, (hash_num64(mmr_index(e)) for e in range(21)), batchsize=4,
+                   progress=reports.append)
+
+        self.assertEqual((p.leaves, p.size), (21, 39))
+        self.assertEqual(reports[-1], p)
+        for i in range(39):
+            self.assertEqual(db.store[i], katdb.store[i])
+
+    def test_ingest_sources(self):
+        """Raw leaf hash files and newline delimited records produce the same MMR"""
+        expect = FlatDB()
+        expect.init_size(39)
+
+        raw = io.BytesIO(b"".join(hash_num64(mmr_index(e)) for e in range(21)))
+        db = FlatDB()
+        ingest(db, read_leaf_hashes(raw), batchsize=5)
+        self.assertEqual(db.store, expect.store)
+
+        records = io.StringIO("".join("%d\n" % mmr_index(e) for e in range(21)))
+        db = FlatDB()
+        ingest(db, read_records(records, hash_num64, int), batchsize=5)
+        self.assertEqual(db.store, expect.store)
+
+        self.assertRaises(ValueError, list, read_leaf_hashes(io.BytesIO(b"x" * 33)))
+
+    def test_ingest_flush(self):
+        """Stores with a flush method are flushed periodically, and at the end"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        flushes = []
+        with MmapDB(os.path.join(tmpdir.name, "mmr.bin")) as db:
+            db.flush = lambda: flushes.append(len(db))
+            p = ingest(db, (hash_num64(e) for e in range(100)), batchsize=10, flush_interval=30)
+
+        self.assertEqual(p.size, mmr_index(100))
+        self.assertEqual(flushes, [mmr_index(30), mmr_index(60), mmr_index(90), mmr_index(100)])
+
+
+    def test_ingest_resume(self):
+        """A backfill killed part way resumes from its last flush"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        filename = os.path.join(tmpdir.name, "mmr.bin")
+        raw = io.BytesIO(b"".join(hash_num64(e) for e in range(100)))
+
+        def killed(leaves, after):
+            for (e, f) in enumerate(leaves):
+                if e == after:
+                    raise KeyboardInterrupt()
+                yield f
+
+        db = MmapDB(filename)
+        with self.assertRaises(KeyboardInterrupt):
+            ingest(db, killed(read_leaf_hashes(raw), 75), batchsize=10, flush_interval=30)
+        del db  # without close
+
+        with MmapDB(filename) as db:
+            self.assertEqual(skip_ingested(db, raw), 60)
+            ingest(db, read_leaf_hashes(raw), batchsize=10)
+
+        expect = FlatDB()
+        add_leaf_hashes(expect, [hash_num64(e) for e in range(100)])
+        with MmapDB(filename) as db:
+            self.assertEqual([bytes(v) for v in db.get_many(range(len(db)))], expect.store)
+
+
+class TestHashBackend(unittest.TestCase):
+
+    def test_sha256_backend(self):
+        """The sha256 backend is byte identical to hash_pospair64"""
+        hasher = hash_backend("sha256")
+        values = [hash_num64(v) for v in range(8)]
+        positions = [1, 2, 3, 255, 256, 1 << 32, (1 << 64) - 1, 7]
+
+        expect = [hash_pospair64(pos, a, b) for (pos, a, b) in zip(positions, values, values[1:])]
+        self.assertEqual(
+            [hasher.hash_pospair64(pos, a, b) for (pos, a, b) in zip(positions, values, values[1:])],
+            expect)
+        self.assertEqual(hasher.hash_pospairs64(positions, values, values[1:]), expect)
+
+        views = [memoryview(v) for v in values]
+        self.assertEqual(hasher.hash_pospair64(1, views[0], views[1]), expect[0])
+        self.assertEqual(hasher.hash_pospairs64(positions, views, views[1:]), expect)
+
+        odd = [b"x" * 31, b"x" * 33, b"", memoryview(b"x" * 31)]
+        for a in odd:
+            self.assertEqual(hasher.hash_pospair64(9, a, values[0]), hash_pospair64(9, a, values[0]))
+            self.assertEqual(hasher.hash_pospair64(9, values[0], a), hash_pospair64(9, values[0], a))
+        self.assertEqual(
+            hasher.hash_pospairs64([9] * 5, odd + [values[0]], [values[1]] * 5),
+            [hash_pospair64(9, a, values[1]) for a in odd + [values[0]]])
+
+        self.assertRaises(ValueError, hash_backend, "md5")
+
+    def test_hasher_plumbed(self):
+        """The reference algorithms and KatDB use the hasher they are given"""
+        calls = []
+
+        class CountingBackend:
+            def hash_pospair64(self, pos, a, b):
+                calls.append(pos)
+                return hash_pospair64(pos, a, b)
+
+        hasher = CountingBackend()
+        expect = KatDB()
+        expect.init_canonical39()
+
+        katdb = KatDB(hasher)
+        katdb.init_canonical39()
+        self.assertEqual(katdb.store, expect.store)
+        self.assertEqual(len(calls), 39 - 21)
+
+        del calls[:]
+        db = FlatDB()
+        for e in range(21):
+            add_leaf_hash(db, hash_num64(mmr_index(e)), hasher)
+        self.assertEqual(db.store, [expect.store[i] for i in range(39)])
+        self.assertEqual(len(calls), 39 - 21)
+
+        del calls[:]
+        proof = inclusion_proof(db, 0, 38)
+        self.assertEqual(included_root(0, db.get(0), proof, hasher), db.get(30))
+        self.assertEqual(len(calls), len(proof))
+
+        del calls[:]
+        proofs = consistency_proof(db, 10, 38)
+        self.assertTrue(verify_consistent_roots(
+            10, [db.get(i) for i in peaks(10)], [db.get(i) for i in peaks(38)], proofs, hasher))
+        self.assertEqual(len(calls), sum(len(path) for path in proofs))
+
+    def test_hasher(self):
+        """Algorithms given the sha256 backend produce the canonical db"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+        leaves = [hash_num64(mmr_index(e)) for e in range(21)]
+
+        db = FlatDB()
+        add_leaf_hashes(db, leaves, hash_backend())
+        self.assertEqual(db.store, [katdb.store[i] for i in range(39)])
+
+        acc = Accumulator(hasher=hash_backend())
+        for f in leaves:
+            acc.add_leaf_hash(f)
+        self.assertEqual(acc.peaks, [katdb.store[p] for p in peaks(38)])
+
+
+class TestParallelBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "mmr.bin")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_build_canonical39(self):
+        """The parallel builder produces the canonical db for every block height"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+        leaves = [hash_num64(mmr_index(e)) for e in range(21)]
+
+        for blockheight in range(6):
+            self.assertEqual(parallel_build.build(self.filename, leaves, blockheight), 39)
+            with MmapDB(self.filename) as db:
+                for i in range(39):
+                    self.assertEqual(db.get(i), katdb.store[i])
+
+    def test_build(self):
+        """The parallel builder matches add_leaf_hash for many leaf counts"""
+        leaves = [hash_num64(e) for e in range(150)]
+        expect = FlatDB()
+
+        for n in range(len(leaves) + 1):
+            if n:
+                add_leaf_hash(expect, leaves[n - 1])
+            size = parallel_build.build(self.filename, leaves[:n], blockheight=n % 5)
+            self.assertEqual(size, len(expect.store))
+            with open(self.filename, "rb") as f:
+                self.assertEqual(f.read(), b"".join(expect.store))
+
+    def test_build_executor(self):
+        """Blocks hashed by a process pool produce the same nodes"""
+        leaves = [hash_num64(e) for e in range(1000)]
+        expect = FlatDB()
+        add_leaf_hashes(expect, leaves)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            parallel_build.build(self.filename, leaves, executor=executor)
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), b"".join(expect.store))
+
+    def test_build_window(self):
+        """Leaves are read from an iterator, with at most window blocks in flight"""
+        leaves = [hash_num64(e) for e in range(1000)]
+        expect = FlatDB()
+        add_leaf_hashes(expect, leaves)
+
+        class Executor(concurrent.futures.ThreadPoolExecutor):
+            """Records the most blocks submitted, but whose roots are not yet collected"""
+            inflight = peak = 0
+
+            def submit(self, fn, *args):
+                executor.inflight += 1
+                executor.peak = max(executor.peak, executor.inflight)
+                future = super().submit(fn, *args)
+                result = future.result
+
+                def collected():
+                    executor.inflight -= 1
+                    return result()
+                future.result = collected
+                return future
+
+        with Executor(2) as executor:
+            size = parallel_build.build(
+                self.filename, iter(leaves), blockheight=4, executor=executor, window=3)
+        self.assertEqual(size, len(expect.store))
+        self.assertEqual(executor.peak, 3)
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), b"".join(expect.store))
+
+    def test_build_file(self):
+        """Workers given only their block's position read it from the leaf file"""
+        leafname = os.path.join(self.tmpdir.name, "leaves.bin")
+        leaves = [hash_num64(e) for e in range(150)]
+        expect = FlatDB()
+
+        for n in range(len(leaves) + 1):
+            if n:
+                add_leaf_hash(expect, leaves[n - 1])
+            with open(leafname, "wb") as f:
+                f.write(b"".join(leaves[:n]))
+            size = parallel_build.build_file(self.filename, leafname, blockheight=n % 5)
+            self.assertEqual(size, len(expect.store))
+            with open(self.filename, "rb") as f:
+                self.assertEqual(f.read(), b"".join(expect.store))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            parallel_build.build_file(self.filename, leafname, blockheight=3, executor=executor)
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), b"".join(expect.store))
+
+
+class TestMassifDB(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmpdir.name, "massifs")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_massif_index(self):
+        """Every mmr index is located in the massif whose range contains it"""
+        for height in range(5):
+            k = 0
+            for i in range(5000):
+                (first, end) = massif_range(k, height)
+                if i == end:
+                    k += 1
+                self.assertEqual(massif_index(i, height), k)
+                self.assertTrue(massif_range(k, height)[0] <= i < massif_range(k, height)[1])
+
+    def test_add(self):
+        """Massif stores of every height produce the canonical db"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        for height in range(6):
+            directory = os.path.join(self.directory, str(height))
+            with MassifDB(directory, height) as db:
+                for e in range(21):
+                    add_leaf_hash(db, hash_num64(mmr_index(e)))
+                for i in range(39):
+                    self.assertEqual(db.get(i), katdb.store[i])
+
+            # 21 leaves fill 21 >> height massifs, and start one more if there are any left over
+            self.assertEqual(
+                len(os.listdir(directory)), (21 >> height) + (1 if 21 % (1 << height) else 0))
+
+    def test_reopen(self):
+        """Appends resume at the correct mmr size, and sealed massifs are read only"""
+        expect = FlatDB()
+        add_leaf_hashes(expect, [hash_num64(e) for e in range(200)])
+
+        for stop in (0, 1, 7, 8, 9, 100, 199):
+            directory = os.path.join(self.directory, str(stop))
+            with MassifDB(directory, height=3, cache_massifs=2) as db:
+                for e in range(stop):
+                    add_leaf_hash(db, hash_num64(e))
+
+            with MassifDB(directory, height=3, cache_massifs=2) as db:
+                self.assertEqual(len(db), mmr_index(stop))
+                for e in range(stop, 200):
+                    add_leaf_hash(db, hash_num64(e))
+
+                for i in range(len(expect.store)):
+                    self.assertEqual(db.get(i), expect.store[i])
+
+            sealed = sorted(os.listdir(directory))[:-1]
+            self.assertEqual(len(sealed), 200 // 8 - 1)
+            for name in sealed:
+                self.assertEqual(os.stat(os.path.join(directory, name)).st_mode & 0o222, 0)
+
+        self.assertRaises(ValueError, MassifDB, directory, height=4)
+
+    def test_reopen_incomplete(self):
+        """A massif which does not end with a complete mmr is truncated back to one"""
+        expect = FlatDB()
+        add_leaf_hashes(expect, [hash_num64(e) for e in range(7)])
+
+        for torn in (hash_num64(5), hash_num64(5)[:9], hash_num64(5) + hash_num64(6)[:3]):
+            directory = os.path.join(self.directory, str(len(torn)))
+            with MassifDB(directory, height=3) as db:
+                for e in range(5):
+                    add_leaf_hash(db, hash_num64(e))
+            filename = os.path.join(directory, "%016d.mmr" % 0)
+            with open(filename, "ab") as f:
+                f.write(torn)
+
+            with MassifDB(directory, height=3) as db:
+                self.assertEqual(len(db), mmr_index(5))
+                self.assertEqual(os.path.getsize(filename), HEADER.size + mmr_index(5) * 32)
+                for e in range(5, 7):
+                    add_leaf_hash(db, hash_num64(e))
+                self.assertEqual([db.get(i) for i in range(len(expect.store))], expect.store)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_killed(self):
+        """A writer killed without closing leaves a store which re-opens at its last whole leaf"""
+        expect = FlatDB()
+        add_leaf_hashes(expect, [hash_num64(e) for e in range(150)])
+
+        for stop in range(0, 140, 9):
+            directory = os.path.join(self.directory, str(stop))
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    db = MassifDB(directory, height=4)
+                    for e in range(stop):
+                        add_leaf_hash(db, hash_num64(e))
+                    # killed part way through the next leaf
+                    db.append(hash_num64(stop))
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+
+            # the extra leaf node is only kept if it is a whole leaf on its own
+            resume = complete_leaf_count(mmr_index(stop) + 1)
+            with MassifDB(directory, height=4) as db:
+                self.assertEqual(len(db), mmr_index(resume))
+                for e in range(resume, 150):
+                    add_leaf_hash(db, hash_num64(e))
+                self.assertEqual([db.get(i) for i in range(len(expect.store))], expect.store)
+
+
+    def test_reopen_torn_header(self):
+        """A trailing massif with an empty or torn header is treated as not yet started"""
+        expect = FlatDB()
+        add_leaf_hashes(expect, [hash_num64(e) for e in range(40)])
+
+        for torn in (b"", b"MMRM\x01", HEADER.pack(b"MMRM", 1, 3, mmr_index(16), 1)):
+            directory = os.path.join(self.directory, str(len(torn)))
+            with MassifDB(directory, height=3) as db:
+                for e in range(16):
+                    add_leaf_hash(db, hash_num64(e))
+            with open(os.path.join(directory, "%016d.mmr" % 2), "wb") as f:
+                f.write(torn)
+
+            with MassifDB(directory, height=3) as db:
+                self.assertEqual(len(db), mmr_index(16))
+                for e in range(16, 40):
+                    add_leaf_hash(db, hash_num64(e))
+                self.assertEqual([db.get(i) for i in range(len(expect.store))], expect.store)
+
+        with open(os.path.join(directory, "%016d.mmr" % 1), "rb") as f:
+            data = f.read()
+        self.assertRaises(ValueError, db._read_header, 1, data[:HEADER.size - 1])
+
+
+class TestCachingDB(unittest.TestCase):
+
+    def test_proofs(self):
+        """Proofs read through the cache are unchanged, and each node is read from the db once"""
+        db = FlatDB()
+        db.init_size(39)
+        cached = CachingDB(db, pin_height=3, budget=1 << 20)
+
+        read = set()
+        for ito in complete_mmr_indices:
+            for i in range(ito + 1):
+                self.assertEqual(inclusion_proof(cached, i, ito), inclusion_proof(db, i, ito))
+                read.update(inclusion_proof_path(i, ito))
+
+        stats = cached.stats()
+        self.assertEqual(sum(misses for (_, misses) in stats.values()), len(read))
+        self.assertEqual(cached.hit_rate(3), 1 - stats[3][1] / sum(stats[3]))
+        self.assertEqual(set(cached.pinned), set([14, 29]))
+
+    def test_eviction(self):
+        """Lower nodes are evicted to stay within the budget, pinned nodes are kept"""
+        db = FlatDB()
+        db.init_size(39)
+        cached = CachingDB(db, pin_height=2, budget=2 * (32 + CachingDB.ENTRY_OVERHEAD))
+
+        for i in (0, 1, 2, 6, 3, 0):
+            self.assertEqual(cached.get(i), db.get(i))
+
+        self.assertEqual(list(cached.lru), [3, 0])
+        self.assertEqual(cached.lrubytes, 2 * (32 + CachingDB.ENTRY_OVERHEAD))
+        self.assertEqual(list(cached.pinned), [6])
+        self.assertEqual(cached.pinnedbytes, 32 + CachingDB.ENTRY_OVERHEAD)
+        self.assertEqual(cached.stats(), {0: (0, 4), 1: (0, 1), 2: (0, 1)})
+
+        cached.get(6)
+        cached.get(0)
+        self.assertEqual(cached.stats(), {0: (1, 4), 1: (0, 1), 2: (1, 1)})
+
+    def test_budget_memory(self):
+        """The budget closely bounds the memory actually used by the cache"""
+        import tracemalloc
+
+        class HashDB:
+            def get(self, i):
+                return hash_num64(i)
+
+        cached = CachingDB(HashDB(), pin_height=64, budget=10000 * (32 + CachingDB.ENTRY_OVERHEAD))
+        tracemalloc.start()
+        try:
+            for i in range(1 << 40, (1 << 40) + 20000):
+                cached.get(i)
+            (used, _) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(len(cached.lru), 10000)
+        self.assertLess(abs(used / cached.budget - 1), 0.25)
+
+    def test_append(self):
+        """Appends pass through to the wrapped db"""
+        cached = CachingDB(FlatDB())
+        add_leaf_hashes(cached, [hash_num64(mmr_index(e)) for e in range(21)])
+        self.assertEqual(len(cached), 39)
+        self.assertEqual(cached.get(30), cached.db.get(30))
+
+
+class TestAsyncAlgorithms(unittest.IsolatedAsyncioTestCase):
+
+    async def _canonical39(self, latency=0.0):
+        db = AsyncFlatDB(latency)
+        for e in range(21):
+            await async_add_leaf_hash(db, hash_num64(mmr_index(e)))
+        return db
+
+    async def test_async_add_leaf_hash(self):
+        """Adding the 21 canonical leaf values produces the canonical db"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        db = await self._canonical39()
+        self.assertEqual(db.store, [katdb.store[i] for i in range(39)])
+
+    async def test_concurrent_add_leaf_hash(self):
+        """Concurrent appends to one store are serialised, in the order they were made"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+
+        db = AsyncFlatDB(latency=0.001)
+        sizes = await asyncio.gather(
+            *[async_add_leaf_hash(db, hash_num64(mmr_index(e))) for e in range(21)])
+        self.assertEqual(sizes, [mmr_index(e + 1) for e in range(21)])
+        self.assertEqual(db.store, [katdb.store[i] for i in range(39)])
+
+    async def test_async_proofs(self):
+        """Async proofs match the synchronous proofs"""
+        katdb = KatDB()
+        katdb.init_canonical39()
+        db = await self._canonical39()
+
+        for (i, ito) in enumerate(complete_mmr_indices):
+            for ii in range(ito + 1):
+                self.assertEqual(
+                    await async_inclusion_proof(db, ii, ito), inclusion_proof(katdb, ii, ito))
+            for ifrom in complete_mmr_indices[:i]:
+                self.assertEqual(
+                    await async_consistency_proof(db, ifrom, ito),
+                    consistency_proof(katdb, ifrom, ito))
+
+    async def test_bounded_concurrency(self):
+        """Proof nodes are fetched concurrently, within the concurrency bound"""
+        db = await self._canonical39(latency=0.001)
+
+        db.max_concurrent = 0
+        await async_consistency_proof(db, 0, 38, concurrency=2)
+        self.assertEqual(db.max_concurrent, 2)
+
+        db.max_concurrent = 0
+        db.reads = 0
+        proof = await async_consistency_proof(db, 10, 38, concurrency=16)
+        self.assertEqual(db.reads, len(set(i for path in consistency_proof_paths(10, 38) for i in path)))
+        self.assertEqual(db.max_concurrent, db.reads)
+        self.assertEqual(len(proof), len(peaks(10)))
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_instrumented(self):
+        """Hashes, reads, writes and bytes hashed are counted for each top level call"""
+        spans = []
+        with instrumented(lambda name, counters: spans.append((name, counters))) as inst:
+            db = FlatDB()
+            for e in range(21):
+                algorithms.add_leaf_hash(db, hash_num64(mmr_index(e)))
+
+            proof = algorithms.inclusion_proof(db, 0, 38)
+            proofs = algorithms.consistency_proof(db, 10, 38)
+            self.assertTrue(algorithms.verify_consistent_roots(
+                10, [db.get(i) for i in peaks(10)], [db.get(i) for i in peaks(38)], proofs))
+
+        report = inst.report()
+        self.assertEqual(report["add_leaf_hash"]["calls"], 21)
+        self.assertEqual(report["add_leaf_hash"]["writes"], 39)
+        self.assertEqual(report["add_leaf_hash"]["hashes"], 39 - 21)
+        self.assertEqual(report["add_leaf_hash"]["reads"], 2 * (39 - 21))
+        self.assertEqual(report["add_leaf_hash"]["hashed_bytes"], 72 * (39 - 21))
+
+        self.assertEqual(report["inclusion_proof"]["reads"], len(proof))
+        self.assertEqual(report["inclusion_proof"]["hashes"], 0)
+        self.assertEqual(
+            report["consistency_proof"]["reads"], len(set(sum(consistency_proof_paths(10, 38), []))))
+        self.assertEqual(
+            report["verify_consistent_roots"]["hashes"], sum(len(path) for path in proofs))
+
+        self.assertEqual([name for (name, _) in spans], ["add_leaf_hash"] * 21 + [
+            "inclusion_proof", "consistency_proof", "verify_consistent_roots"])
+        self.assertGreater(report["add_leaf_hash"]["seconds"], 0)
+
+    def test_imported_names(self):
+        """Calls through directly imported names, batches and hashers are all counted"""
+        hasher = hash_backend()
+        with instrumented() as inst:
+            db = FlatDB()
+            db.init_size(39)
+            add_leaf(db, hash_num64(21))
+            add_leaf_hashes(db, [hash_num64(e) for e in range(22, 30)])
+            add_leaf_hash(db, hash_num64(30), hasher=hasher)
+            inclusion_proof_by_leaf(db, 3, 31)
+            hasher.hash_pospairs64([1, 2], [hash_num64(0)] * 2, [hash_num64(1)] * 2)
+
+        report = inst.report()
+        self.assertEqual(report["add_leaf_hash"]["calls"], 21 + 1 + 1)
+        self.assertEqual(report["add_leaf_hash"]["hashes"], mmr_index(23) - 23)
+        self.assertEqual(report["add_leaf_hashes"]["calls"], 1)
+        self.assertEqual(report["add_leaf_hashes"]["writes"], mmr_index(30) - mmr_index(22))
+        self.assertEqual(report["add_leaf_hashes"]["hashes"], mmr_index(30) - mmr_index(22) - 8)
+        self.assertEqual(report["inclusion_proof"]["calls"], 1)
+        # the batch was not made within a span
+        self.assertEqual(sum(totals["hashes"] for totals in report.values()), mmr_index(31) - 31)
+
+    def test_restored(self):
+        """The hooks are only set while a block is open"""
+        self.assertIsNone(algorithms.hooks)
+        with instrumented():
+            self.assertIsNotNone(algorithms.hooks)
+            with instrumented():
+                pass
+            self.assertIsNotNone(algorithms.hooks)
+        self.assertIsNone(algorithms.hooks)
+
+
+    def test_overlapping_threads(self):
+        """Overlapping blocks on two threads each count their own calls, and restore the module"""
+        import threading
+
+        entered = [threading.Event(), threading.Event()]
+        exited = threading.Event()
+        reports = {}
+
+        def request(k, leaves, exit_first):
+            with instrumented() as inst:
+                entered[k].set()
+                entered[1 - k].wait()
+                db = FlatDB()
+                for e in range(leaves):
+                    algorithms.add_leaf_hash(db, hash_num64(e))
+                if not exit_first:
+                    exited.wait()
+            reports[k] = inst.report()
+            if exit_first:
+                exited.set()
+
+        threads = [threading.Thread(target=request, args=(0, 3, True)),
+                   threading.Thread(target=request, args=(1, 21, False))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(reports[0]["add_leaf_hash"]["calls"], 3)
+        self.assertEqual(reports[0]["add_leaf_hash"]["hashes"], mmr_index(3) - 3)
+        self.assertEqual(reports[1]["add_leaf_hash"]["calls"], 21)
+        self.assertEqual(reports[1]["add_leaf_hash"]["hashes"], 39 - 21)
+        self.assertIsNone(algorithms.hooks)
+
+
 class TestVerifyInclusion(unittest.TestCase):
 
     def test_verify_inclusion(self):
@@ -265,6 +1516,172 @@ class TestVerifyInclusion(unittest.TestCase):
             self.assertEqual(root, proven)
 
 
+class TestPathCache(unittest.TestCase):
+
+    def test_inclusion_proof_path(self):
+        """Cached paths, including extended paths, match inclusion_proof_path"""
+        cache = PathCache()
+        for ito in complete_mmr_indices:
+            for i in range(ito + 1):
+                self.assertEqual(cache.inclusion_proof_path(i, ito), inclusion_proof_path(i, ito))
+                self.assertEqual(cache.inclusion_proof_path(i, ito), inclusion_proof_path(i, ito))
+
+        info = cache.cache_info()
+        self.assertEqual(info.misses, 39)
+        self.assertEqual(info.hits, info.misses + info.extended)
+        self.assertEqual(info.currsize, info.misses + info.extended)
+
+    def test_consistency_proof_paths(self):
+        """Cached consistency paths match consistency_proof_paths"""
+        cache = PathCache()
+        for (i, ito) in enumerate(complete_mmr_indices):
+            for ifrom in complete_mmr_indices[:i]:
+                self.assertEqual(
+                    cache.consistency_proof_paths(ifrom, ito), consistency_proof_paths(ifrom, ito))
+
+    def test_eviction(self):
+        """The least recently used paths are evicted"""
+        cache = PathCache(maxsize=2)
+        cache.inclusion_proof_path(0, 2)
+        cache.inclusion_proof_path(3, 6)
+        cache.inclusion_proof_path(0, 2)
+        cache.inclusion_proof_path(7, 9)
+
+        self.assertEqual(list(cache.paths), [(0, 2), (7, 9)])
+        self.assertEqual(cache.sizes, {0: [2], 7: [9]})
+
+        cache.inclusion_proof_path(3, 6)
+        self.assertEqual(cache.cache_info().misses, 4)
+        self.assertEqual(cache.cache_info().hits, 1)
+
+
+class TestRangeProofs(unittest.TestCase):
+
+    def setUp(self):
+        self.db = KatDB()
+        self.db.init_canonical39()
+
+    def test_ranges(self):
+        """Every leaf range of every complete MMR verifies, with no more nodes than its single proofs"""
+        for c in complete_mmr_indices:
+            accumulator = [self.db.get(p) for p in peaks(c)]
+            for efrom in range(leaf_count(c)):
+                for eto in range(efrom + 1, leaf_count(c) + 1):
+                    indices = [mmr_index(e) for e in range(efrom, eto)]
+                    values = [self.db.get(i) for i in indices]
+                    proof = range_proof(self.db, efrom, eto, c)
+                    self.assertTrue(verify_range_inclusion(efrom, values, proof, c, accumulator))
+
+                    union = set(j for i in indices for j in inclusion_proof_path(i, c))
+                    self.assertLessEqual(len(proof), len(union - set(indices)))
+
+        # all the leaves need no siblings at all
+        self.assertEqual(multi_proof_path([mmr_index(e) for e in range(21)], 38), [])
+
+    def test_frontier(self):
+        """Only the siblings that can not be computed are included"""
+        # leaves 2..5 of MMR(38), at 3, 4, 7, 8
+        self.assertEqual(multi_proof_path([3, 4, 7, 8], 38), [2, 12, 29])
+        # proving 5 as well adds nothing, and proving 13 removes its children
+        self.assertEqual(multi_proof_path([3, 4, 5, 7, 8], 38), [2, 12, 29])
+        self.assertEqual(multi_proof_path([3, 13], 38), [4, 2, 29])
+
+    def test_subsets(self):
+        """Arbitrary sets of nodes verify, and tampering is detected"""
+        rng = random.Random(0)
+        c = 38
+        accumulator = [self.db.get(p) for p in peaks(c)]
+        for _ in range(200):
+            indices = rng.sample(range(c + 1), rng.randint(1, 6))
+            values = [self.db.get(i) for i in indices]
+            proof = multi_proof(self.db, indices, c)
+            self.assertTrue(verify_multi_inclusion(indices, values, proof, c, accumulator))
+
+            k = rng.randrange(len(values))
+            self.assertFalse(verify_multi_inclusion(
+                indices, values[:k] + [hash_num64(99)] + values[k + 1:], proof, c, accumulator))
+            if proof:
+                self.assertFalse(verify_multi_inclusion(indices, values, proof[1:], c, accumulator))
+            self.assertFalse(verify_multi_inclusion(
+                indices, values, proof + [hash_num64(99)], c, accumulator))
+
+    def test_accumulator_length(self):
+        """An accumulator of the wrong length is rejected, not indexed"""
+        c = 38
+        accumulator = [self.db.get(p) for p in peaks(c)]
+        indices = [mmr_index(e) for e in range(18, 21)]
+        values = [self.db.get(i) for i in indices]
+        proof = multi_proof(self.db, indices, c)
+        self.assertTrue(verify_multi_inclusion(indices, values, proof, c, accumulator))
+        self.assertFalse(verify_multi_inclusion(indices, values, proof, c, []))
+        self.assertFalse(verify_multi_inclusion(indices, values, proof, c, accumulator[:-1]))
+        self.assertFalse(verify_multi_inclusion(
+            indices, values, proof, c, accumulator + [hash_num64(99)]))
+        self.assertFalse(verify_range_inclusion(18, values, proof, c, []))
+
+
+class TestVerifyInclusionsBatch(unittest.TestCase):
+
+    def _items(self):
+        db = KatDB()
+        db.init_canonical39()
+
+        items = []
+        for (i, e, s, pathindices, ai, accumulator) in inclusion_paths_table(39):
+            items.append((
+                i, db.get(i), [db.get(ip) for ip in pathindices], db.get(accumulator[ai])))
+        return items
+
+    def test_verify_inclusions_batch(self):
+        """Every inclusion proof for every node verifies in a single batch"""
+        items = self._items()
+        self.assertEqual(verify_inclusions_batch(items), [True] * len(items))
+
+    def test_verify_inclusions_batch_mmap(self):
+        """Proofs read as memoryviews from the mmap db verify"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        with MmapDB(os.path.join(tmpdir.name, "mmr.bin")) as db:
+            for e in range(21):
+                add_leaf_hash(db, hash_num64(mmr_index(e)))
+            items = [(i, db.get(i), inclusion_proof(db, i, 38),
+                      db.get(accumulator_root(i, 38))) for i in range(39)]
+            self.assertEqual(verify_inclusions_batch(items), [True] * 39)
+            del items
+
+    def test_verify_inclusions_batch_failures(self):
+        """Only the items with a bad proof, node or root fail to verify"""
+        items = self._items()
+        bad = hash_num64(1 << 40)
+        expect = [True] * len(items)
+
+        for j in range(0, len(items), 3):
+            (i, nodehash, proof, root) = items[j]
+            if j % 2 and proof:
+                proof = proof[:-1] + [bad]
+            elif j % 2:
+                nodehash = bad
+            else:
+                root = bad
+            items[j] = (i, nodehash, proof, root)
+            expect[j] = False
+
+        self.assertEqual(verify_inclusions_batch(items), expect)
+
+    def test_verify_inclusions_batch_executor(self):
+        """Chunks verified by a process pool produce the same results in the original order"""
+        items = self._items()
+        items.reverse()
+        items[5] = items[5][:3] + (hash_num64(1 << 40),)
+        expect = verify_inclusions_batch(items)
+        self.assertFalse(expect[5])
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(
+                verify_inclusions_batch(items, executor=executor, chunksize=16), expect)
+
+
 class TestVerifyConsistency(unittest.TestCase):
 
     def test_verify_consistent_roots(self):
@@ -376,6 +1793,158 @@ class TestVerifyConsistency(unittest.TestCase):
                     self.assertTrue(d in accumulatordepths)
                     self.assertEqual(toaccumulator[accumulatordepths[d]], root)
 
+    def test_consistency_proof_nodes(self):
+        """The deduplicated paths match consistency_proof_paths, for large MMRs too"""
+        sizes = complete_mmr_indices + [complete_mmr(i) for i in (1000, 5000, 1 << 20, 1 << 40)]
+        for (i, ito) in enumerate(sizes):
+            for ifrom in sizes[:i]:
+                nodes, refs = consistency_proof_nodes(ifrom, ito)
+                self.assertEqual(len(nodes), len(set(nodes)))
+                self.assertEqual(
+                    [[nodes[r] for r in path] for path in refs],
+                    consistency_proof_paths(ifrom, ito))
+
+    def test_consistency_proof_deduplicated(self):
+        """Deduplicated proofs read each node once and verify"""
+
+        class CountingDB(KatDB):
+            def get(self, i):
+                self.reads.append(i)
+                return super().get(i)
+
+            def get_many(self, indices):
+                self.reads.extend(indices)
+                return super().get_many(indices)
+
+        db = CountingDB()
+        db.init_canonical39()
+
+        for (i, ito) in enumerate(complete_mmr_indices):
+            for ifrom in complete_mmr_indices[:i]:
+                db.reads = []
+                values, refs = consistency_proof_deduplicated(db, ifrom, ito)
+                self.assertEqual(db.reads, sorted(set(db.reads)))
+
+                proofs = expand_consistency_proof(values, refs)
+                self.assertEqual(proofs, consistency_proof(db, ifrom, ito))
+
+                accumulatorfrom = [db.get(ii) for ii in peaks(ifrom)]
+                accumulatorto = [db.get(ii) for ii in peaks(ito)]
+                self.assertTrue(
+                    verify_consistent_roots(ifrom, accumulatorfrom, accumulatorto, proofs))
+
+
+    def test_verify_consistent_roots_fast(self):
+        """The fast verifier accepts consistent proofs and reports the proven peaks"""
+        db = FlatDB()
+        db.init_size(1000)
+        sizes = [ix for ix in range(1000) if complete_mmr(ix) == ix]
+
+        for (i, ito) in enumerate(sizes):
+            accumulatorto = [db.get(ii) for ii in peaks(ito)]
+            depths = dict((d, k) for (k, d) in enumerate(peak_depths(ito)))
+
+            for ifrom in sizes[max(0, i - 40):i]:
+                proofs = consistency_proof(db, ifrom, ito)
+                peakindicesfrom = peaks(ifrom)
+                accumulatorfrom = [db.get(ii) for ii in peakindicesfrom]
+
+                (ok, proven) = verify_consistent_roots_fast(
+                    ifrom, accumulatorfrom, accumulatorto, proofs)
+                self.assertTrue(ok)
+
+                expect = sorted(set(
+                    depths[len(proof) + index_height(ipeak)]
+                    for (ipeak, proof) in zip(peakindicesfrom, proofs)))
+                self.assertEqual(proven, expect)
+
+    def test_verify_consistent_roots_fast_rejects(self):
+        """The fast verifier rejects exactly the proofs verify_consistent_roots rejects"""
+        db = KatDB()
+        db.init_canonical39()
+        bad = hash_num64(1 << 40)
+
+        for (i, ito) in enumerate(complete_mmr_indices):
+            accumulatorto = [db.get(ii) for ii in peaks(ito)]
+            for ifrom in complete_mmr_indices[:i]:
+                proofs = consistency_proof(db, ifrom, ito)
+                accumulatorfrom = [db.get(ii) for ii in peaks(ifrom)]
+
+                for k in range(len(proofs)):
+                    for d in range(len(proofs[k])):
+                        tampered = [list(p) for p in proofs]
+                        tampered[k][d] = bad
+                        self.assertFalse(
+                            verify_consistent_roots(ifrom, accumulatorfrom, accumulatorto, tampered))
+                        self.assertEqual(
+                            verify_consistent_roots_fast(
+                                ifrom, accumulatorfrom, accumulatorto, tampered), (False, []))
+
+                    tampered = list(accumulatorfrom)
+                    tampered[k] = bad
+                    self.assertEqual(
+                        verify_consistent_roots_fast(ifrom, tampered, accumulatorto, proofs),
+                        (False, []))
+
+
+class TestProofEncoding(unittest.TestCase):
+
+    def test_uvarint(self):
+        """Unsigned varints round trip"""
+        for v in (0, 1, 127, 128, 255, 300, 1 << 32, (1 << 64) - 1):
+            data = b"x" + proof_encoding.encode_uvarint(v)
+            self.assertEqual(proof_encoding.decode_uvarint(data, 1), (v, len(data)))
+        self.assertRaises(ValueError, proof_encoding.decode_uvarint, b"\x80", 0)
+
+    def test_inclusion_proofs(self):
+        """Decoded inclusion proofs verify against the accumulator"""
+        db = KatDB()
+        db.init_canonical39()
+
+        for (i, e, s, pathindices, ai, accumulator) in inclusion_paths_table(39):
+            proof = inclusion_proof(db, i, s - 1)
+            data = proof_encoding.encode_inclusion_proof(proof)
+            self.assertEqual(len(data), 2 + 32 * len(proof))
+
+            decoded = proof_encoding.decode_inclusion_proof(data)
+            self.assertEqual(decoded, proof)
+            self.assertEqual(included_root(i, db.get(i), decoded), db.get(accumulator[ai]))
+
+    def test_consistency_proofs(self):
+        """Decoded consistency proofs and accumulators verify"""
+        db = KatDB()
+        db.init_canonical39()
+
+        for (i, ito) in enumerate(complete_mmr_indices):
+            accumulatorto = proof_encoding.decode_accumulator(
+                proof_encoding.encode_accumulator([db.get(ii) for ii in peaks(ito)]))
+
+            for ifrom in complete_mmr_indices[:i]:
+                accumulatorfrom = proof_encoding.decode_accumulator(
+                    proof_encoding.encode_accumulator([db.get(ii) for ii in peaks(ifrom)]))
+
+                proofs = proof_encoding.decode_consistency_proof(
+                    proof_encoding.encode_consistency_proof(consistency_proof(db, ifrom, ito)))
+                self.assertEqual(proofs, consistency_proof(db, ifrom, ito))
+                self.assertTrue(
+                    verify_consistent_roots(ifrom, accumulatorfrom, accumulatorto, proofs))
+
+                path = proof_encoding.decode_consistency_proof_flat(
+                    proof_encoding.encode_consistency_proof_flat(
+                        [db.get(ii) for ii in consistency_proof_flat(ifrom, ito)]))
+                self.assertTrue(
+                    verify_consistency_flat(ifrom, ito, accumulatorfrom, accumulatorto, path))
+
+    def test_decode_errors(self):
+        """Malformed encodings are rejected"""
+        data = proof_encoding.encode_inclusion_proof([hash_num64(0), hash_num64(1)])
+        self.assertRaises(ValueError, proof_encoding.decode_inclusion_proof, data[:-1])
+        self.assertRaises(ValueError, proof_encoding.decode_inclusion_proof, data + b"x")
+        self.assertRaises(ValueError, proof_encoding.decode_accumulator, data)
+        self.assertRaises(ValueError, proof_encoding.decode_consistency_proof, b"")
+        self.assertRaises(ValueError, proof_encoding.encode_accumulator, [b"short"])
+
+
 class TestWitnessUpdate(unittest.TestCase):
 
     def test_witness_update(self):
@@ -417,6 +1986,66 @@ class TestWitnessUpdate(unittest.TestCase):
 
                 ito = complete_mmr(ito+1)
 
+    def test_witness_update_due(self):
+        """A witness changes first at its due index, for leaves this agrees with leaf_witness_update_due"""
+        for iw in range(200):
+            ito = complete_mmr(iw)
+            w = inclusion_proof_path(iw, ito)
+            due = witness_update_due(iw, w)
+
+            while ito < due:
+                self.assertEqual(inclusion_proof_path(iw, ito), w)
+                ito = complete_mmr(ito + 1)
+            self.assertEqual(ito, due)
+            self.assertGreater(len(inclusion_proof_path(iw, ito)), len(w))
+
+            if index_height(iw) == 0:
+                # leaf_witness_update_due counts the leaves to add to the
+                # subtree committed by the next, longer, witness.
+                e = leaf_count(due) - 1
+                self.assertEqual(e + leaf_witness_update_due(e, len(w) + 1), leaf_count(due))
+
+    def test_witness_maintainer(self):
+        """Maintained witnesses always match freshly generated proofs"""
+        db = FlatDB()
+        db.init_size(300)
+        sizes = [ix for ix in range(len(db.store)) if complete_mmr(ix) == ix]
+
+        maintainer = WitnessMaintainer(db)
+        tracked = set()
+        for (k, ito) in enumerate(sizes):
+            updated = maintainer.advance(ito)
+
+            for i in sorted(tracked):
+                expect = inclusion_proof_path(i, ito)
+                self.assertEqual(maintainer.path(i), expect)
+                self.assertEqual(maintainer.values(i), [db.get(ii) for ii in expect])
+                previous = inclusion_proof_path(i, sizes[k - 1])
+                self.assertEqual(i in updated, expect != previous)
+
+            for i in range(sizes[k - 1] + 1 if k else 0, ito + 1):
+                if i % 3 == 0:
+                    maintainer.track(i, i, ito)
+                    tracked.add(i)
+
+            if k % 10 == 9:
+                discard = min(tracked)
+                maintainer.untrack(discard)
+                tracked.remove(discard)
+
+        self.assertEqual(len(maintainer), len(tracked))
+        self.assertEqual(sum(maintainer.pending().values()), len(tracked))
+
+    def test_witness_maintainer_without_db(self):
+        """Paths are maintained without a db, but values can not be"""
+        maintainer = WitnessMaintainer()
+        self.assertRaises(ValueError, maintainer.track, 0, 0, 2, None, [hash_num64(1)])
+
+        maintainer.track(0, 0, 2)
+        self.assertEqual(maintainer.advance(38), [0])
+        self.assertEqual(maintainer.path(0), inclusion_proof_path(0, 38))
+        self.assertIsNone(maintainer.values(0))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,118 @@
+"""Keeping many inclusion witnesses fresh as the MMR grows
+
+A witness for node i, held against MMR(c), proves i up to its current
+accumulator root, R = parent(path[-1]), or i itself if the path is empty. As R
+is a peak of MMR(c), it is the left child of its future parent, which is added
+at R + 2^(h+1), where h is the height of R. Until the first complete MMR
+which includes that parent, the witness is unchanged. Once it does, the witness is extended by the
+inclusion path of R, which is the prefix property tested in TestWitnessUpdate.
+
+WitnessMaintainer schedules each witness by the index at which it next
+changes, so that each append batch only touches the witnesses which are due.
+That index is found with algorithms.next_proof, which gives the leaf count at
+which the witness is next extended.
+"""
+import heapq
+from typing import Dict, List
+
+from algorithms import get_nodes
+from algorithms import inclusion_proof_path
+from algorithms import leaf_count
+from algorithms import mmr_index
+from algorithms import next_proof
+from algorithms import parent
+
+
+def witness_root(i: int, path: List[int]) -> int:
+    """Returns the index of the accumulator root committing i via path"""
+    return parent(path[-1]) if path else i
+
+
+def witness_update_due(i: int, path: List[int]) -> int:
+    """Returns the first complete mmr index for which the witness of i changes
+
+    next_proof counts the leaves, after those up to i, which must be added
+    before the witness is extended. As for leaf_witness_update_due in
+    TestWitnessUpdate, it is given one more than the length of the path. The
+    result is the last index of the MMR with that many leaves.
+    """
+    return mmr_index(leaf_count(i) + next_proof(i, len(path) + 1)) - 1
+
+
+class WitnessMaintainer:
+    """Tracks outstanding witnesses and extends them as they become due
+
+    If a db is provided, the node values of each witness are maintained too,
+    and each extension is read with algorithms.get_nodes.
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.due = []
+        # key -> [i, path, values, version]
+        self.witnesses = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.witnesses)
+
+    def track(self, key, i: int, ito: int, path: List[int] = None, values: List[bytes] = None):
+        """Start maintaining the witness of node i, currently held against MMR(ito)
+
+        values may only be given if the maintainer has a db to extend them from.
+        """
+        if values is not None and self.db is None:
+            raise ValueError("values can only be maintained with a db")
+        if path is None:
+            path = inclusion_proof_path(i, ito)
+        if values is None and self.db is not None:
+            values = get_nodes(self.db, path)
+
+        self.version += 1
+        self.witnesses[key] = [i, list(path), values and list(values), self.version]
+        heapq.heappush(self.due, (witness_update_due(i, path), self.version, key))
+
+    def untrack(self, key):
+        # the scheduled entry is discarded when it is next popped
+        del self.witnesses[key]
+
+    def path(self, key) -> List[int]:
+        return self.witnesses[key][1]
+
+    def values(self, key) -> List[bytes]:
+        return self.witnesses[key][2]
+
+    def advance(self, ito: int) -> List:
+        """Extend every witness which changes in MMR(ito)
+
+        Args:
+            ito (int): the index of the last node of the now complete MMR
+        Returns:
+            The keys of the witnesses which were extended
+        """
+        updated = []
+        while self.due and self.due[0][0] <= ito:
+            (_, version, key) = heapq.heappop(self.due)
+            witness = self.witnesses.get(key)
+            if witness is None or witness[3] != version:
+                continue
+
+            (i, path, values, _) = witness
+            extension = inclusion_proof_path(witness_root(i, path), ito)
+            path.extend(extension)
+            if values is not None:
+                values.extend(get_nodes(self.db, extension))
+
+            heapq.heappush(self.due, (witness_update_due(i, path), version, key))
+            updated.append(key)
+
+        return updated
+
+    def pending(self) -> Dict[int, int]:
+        """Returns the count of witnesses due at each mmr index"""
+        counts = {}
+        for (due, version, key) in self.due:
+            witness = self.witnesses.get(key)
+            if witness is not None and witness[3] == version:
+                counts[due] = counts.get(due, 0) + 1
+        return counts